@@ -0,0 +1,323 @@
+"""
+-------------------------------------------------------
+This file contains the command-line batch runner.
+-------------------------------------------------------
+Usage: python BatchRunner.py job.json [--workers N] [--output DIR]
+
+A job file holds one job spec or a list of them. A spec looks
+like:
+    {"mode": "evaluate",              # evaluate, simulate or train
+     "demand": {"type": "constant", "order": 10, "weeks": 365},
+     "topology": {"initial_order": 5, "initial_stock": 30,
+                  "queue_delay_weeks": 2, "extended_state": false},
+     "cost": {"holding": 0.5, "penalty": 1},
+     "policies": [{"type": "dqn", "checkpoint": "retailer.pt"},
+                  {"type": "order", "target_stock": 30},
+                  {"type": "order", "target_stock": 30},
+                  {"type": "order", "target_stock": 30}],
+     "runs": 100, "workers": 4, "seed": 0,
+     "output": "results/job"}
+evaluate writes the per-run costs to output/results.json,
+simulate also streams every run into trajectory stores under
+output/trajectories, and train trains DQN policies (see
+Sweep.train_trial, configured by a "train" entry) and saves
+their checkpoints. Progress and throughput go to stderr.
+-------------------------------------------------------
+"""
+
+import argparse
+import json
+import multiprocessing
+import os
+import sys
+import time
+
+import numpy as np
+
+from BeerGameSimulator import beer_game_Simulator, OrderPolicy
+from Players import Customer
+from Seeding import SeedManager
+from SupplyChainActor import CostModel
+import Demand
+
+
+ROLES = ('retailer', 'wholesaler', 'distributor', 'factory')
+
+
+def build_customer(spec):
+    """
+    -------------------------------------------------------
+    Builds the Customer of a demand spec.
+    -------------------------------------------------------
+    Preconditions: spec - {"type": "constant", "order", "weeks"},
+            {"type": "random", "max_noise", "weeks"},
+            {"type": "periodic", "base", "amplitude", "period",
+             "max_noise", "weeks"} or
+            {"type": "csv", "path", "store", "item", "stop"}.
+    Postconditions: Returns a Customer with a materialized demand
+        array.
+    -------------------------------------------------------
+    """
+    kind = spec.get('type', 'constant')
+    weeks = spec.get('weeks', 365)
+    if kind == 'constant':
+        return Customer(np.ones(weeks) * spec.get('order', 10), max_noise = spec.get('max_noise', 0))
+    if kind == 'random':
+        return Customer(np.zeros(weeks), max_noise = spec.get('max_noise', 30))
+    if kind == 'periodic':
+        orders = Demand.periodic_demand(spec.get('base', 20), spec.get('amplitude', 10), spec.get('period', 365), weeks = weeks)
+        return Customer(np.fromiter(orders, dtype = np.float64), max_noise = spec.get('max_noise', 0))
+    if kind == 'csv':
+        orders = Demand.load_sales_demand(spec['path'], spec.get('store', 1), spec.get('item', 1), spec.get('stop', weeks))
+        return Customer(orders, max_noise = spec.get('max_noise', 0))
+    raise ValueError('Unknown demand type {0!r}'.format(kind))
+
+
+def build_cost_model(spec):
+    if not spec:
+        return None
+    return CostModel(spec.get('holding'), spec.get('penalty'), spec.get('holding_exponent', 1),
+                     spec.get('penalty_exponent', 1), spec.get('lost_sales', False))
+
+
+def build_policy(spec, seeds = None, nstates = 10, state_width = 5):
+    """
+    -------------------------------------------------------
+    Builds the policy of a policy spec.
+    -------------------------------------------------------
+    Preconditions: spec - {"type": "order", "target_stock"} or
+            {"type": "dqn", "checkpoint"}; either may add
+            "cache": {"maxsize", "quantum"} to wrap it in a
+            CachedPolicy.
+        seeds - an optional SeedManager for stochastic policies.
+        nstates, state_width - the state windows the policy reads, as
+            played by the simulator; a DQN network is sized for them.
+    Postconditions: Returns the policy. torch is only imported for
+        DQN policies.
+    -------------------------------------------------------
+    """
+    kind = spec.get('type', 'order')
+    if kind == 'order':
+        policy = OrderPolicy(spec.get('target_stock', 30))
+    elif kind == 'dqn':
+        import torch
+        from DQN import DQN, DQN_Policy, device
+        network = DQN(nstates, state_width).to(device)
+        network.load_state_dict(torch.load(spec['checkpoint'], map_location = device))
+        network.eval()
+        policy = DQN_Policy(network, rng = seeds.generator() if seeds else None)
+    else:
+        raise ValueError('Unknown policy type {0!r}'.format(kind))
+
+    if 'cache' in spec:
+        from PolicyCache import CachedPolicy
+        policy = CachedPolicy(policy, **spec['cache'])
+    return policy
+
+
+def build_policies(specs, seeds = None, nstates = 10, state_width = 5):
+    if isinstance(specs, dict):
+        specs = [specs] * len(ROLES)
+    return [build_policy(spec, seeds.child(role) if seeds else None, nstates, state_width) for role, spec in zip(ROLES, specs)]
+
+
+def build_simulator(job):
+    topology = job.get('topology', {})
+    return beer_game_Simulator(build_customer(job.get('demand', {})), topology.get('initial_order', 5),
+                               topology.get('initial_stock', 30), topology.get('queue_delay_weeks', 2),
+                               cost_model = build_cost_model(job.get('cost')),
+                               extended_state = topology.get('extended_state', False))
+
+
+def _run_chunk(args):
+    """
+    -------------------------------------------------------
+    Worker entry point: plays a chunk of runs of a job.
+    -------------------------------------------------------
+    Preconditions: args - (job, run indices, root seed record,
+        trajectory directory or None).
+    Postconditions: Returns (run indices, per-run actor costs, weeks
+        played).
+    -------------------------------------------------------
+    """
+    job, runs, seed, trajectories = args
+    seeds = SeedManager.from_record(seed)
+    simulator = build_simulator(job)
+    policies = build_policies(job.get('policies', {'type' : 'order'}), seeds.child('policies', runs[0]), simulator.nstates,
+                              simulator.stateWidth)
+
+    writer = None
+    if trajectories is not None:
+        from TrajectoryStore import TrajectoryWriter
+        writer = TrajectoryWriter(os.path.join(trajectories, 'runs_{0:06d}'.format(runs[0])), simulator.nstates,
+                                  state_width = simulator.stateWidth,
+                                  metadata = {'seed' : seed, 'runs' : [runs[0], runs[-1]]})
+
+    costs = []
+    for run in runs:
+        simulator.init_simulation(*policies)
+        simulator.theCustomer.rng = seeds.child('run', run).generator()
+        if writer is None:
+            simulator.run_simulation(vis = False)
+        else:
+            for week in range(simulator.weeks_to_play):
+                writer.record_step(simulator, simulator.step(), run)
+        costs.append([simulator.myRetailer.GetCostIncurred(), simulator.myWholesaler.GetCostIncurred(),
+                      simulator.myDistributor.GetCostIncurred(), simulator.myFactory.GetCostIncurred()])
+
+    if writer is not None:
+        writer.close()
+    return runs, np.asarray(costs, dtype = np.float64).tolist(), len(runs) * simulator.weeks_to_play
+
+
+def _progress(done, total, weeks, start, unit = 'runs'):
+    elapsed = time.time() - start
+    sys.stderr.write('\r{0}/{1} {2} - {3:.0f} weeks/s - {4:.1f}s'.format(done, total, unit, weeks / max(elapsed, 1e-9), elapsed))
+    sys.stderr.flush()
+
+
+def run_simulations(job, output):
+    """
+    -------------------------------------------------------
+    Runs an evaluate or simulate job across worker processes.
+    -------------------------------------------------------
+    Preconditions: job - a job spec. output - the output directory.
+    Postconditions: Writes and returns the results dict: per-run and
+        mean actor costs, the seed record and throughput figures.
+    -------------------------------------------------------
+    """
+    n_runs = job.get('runs', 1)
+    n_workers = job.get('workers', 1)
+    seeds = SeedManager(job.get('seed'))
+    trajectories = os.path.join(output, 'trajectories') if job.get('mode') == 'simulate' else None
+    cost_model = build_cost_model(job.get('cost'))
+    if trajectories is not None and cost_model is not None and cost_model.gridShape != ():
+        raise ValueError('simulate records a single cost structure : run evaluate for a cost grid')
+    if trajectories is not None and os.path.exists(trajectories):
+        # Writers append to existing stores, which would mix two jobs' runs.
+        raise ValueError('{0} already exists, remove it or pick another output'.format(trajectories))
+
+    chunk = job.get('chunk', max(1, min(100, n_runs // (4 * n_workers) or 1)))
+    tasks = [(job, list(range(start, min(start + chunk, n_runs))), seeds.record(), trajectories)
+             for start in range(0, n_runs, chunk)]
+
+    costs = [None] * n_runs
+    done, weeks, start = 0, 0, time.time()
+    pool = multiprocessing.Pool(n_workers) if n_workers > 1 else None
+    try:
+        results = pool.imap_unordered(_run_chunk, tasks) if pool else map(_run_chunk, tasks)
+        for runs, run_costs, run_weeks in results:
+            for run, cost in zip(runs, run_costs):
+                costs[run] = cost
+            done, weeks = done + len(runs), weeks + run_weeks
+            _progress(done, n_runs, weeks, start)
+    finally:
+        if pool:
+            pool.close()
+            pool.join()
+    sys.stderr.write('\n')
+
+    elapsed = time.time() - start
+    mean_costs = np.mean(costs, axis = 0)
+    return {'mode' : job.get('mode', 'evaluate'), 'seed' : seeds.record(), 'runs' : n_runs, 'workers' : n_workers,
+            'costs' : costs, 'mean_costs' : dict(zip(ROLES, np.asarray(mean_costs).tolist())),
+            'total_cost' : np.sum(mean_costs, axis = 0).tolist(), 'elapsed' : elapsed,
+            'runs_per_second' : n_runs / elapsed, 'weeks_per_second' : weeks / elapsed}
+
+
+def run_training(job, output):
+    """
+    -------------------------------------------------------
+    Runs a train job in this process.
+    -------------------------------------------------------
+    Preconditions: job - a job spec whose "train" entry holds a
+        Sweep.DEFAULT_CONFIG override plus num_episodes, eval_every
+        and n_eval_sims.
+    Postconditions: Saves retailer.pt and wholesaler.pt in output and
+        returns the results dict with the evaluated cost history.
+    -------------------------------------------------------
+    """
+    import torch
+    from Sweep import DEFAULT_CONFIG, train_trial
+
+    train = dict(job.get('train', {}))
+    num_episodes = train.pop('num_episodes', 500)
+    eval_every = train.pop('eval_every', 25)
+    n_eval_sims = train.pop('n_eval_sims', 1)
+    config = dict(DEFAULT_CONFIG, **train)
+
+    seeds = SeedManager(job.get('seed'))
+    seeds.child('torch').seed_torch()
+    simulator = build_simulator(job)
+    simulator.seeds = seeds.child('simulator')
+    base_policy = build_policy(job.get('base_policy', {'type' : 'order', 'target_stock' : simulator.initial_stock}),
+                               nstates = simulator.nstates, state_width = simulator.stateWidth)
+
+    history, start = [], time.time()
+    def report(episode, cost):
+        history.append((episode, cost))
+        _progress(episode, num_episodes, episode * simulator.weeks_to_play, start, 'episodes')
+        sys.stderr.write(' - cost {0:.1f}'.format(cost))
+
+    policies = train_trial(config, simulator, base_policy, num_episodes, eval_every, n_eval_sims, report, seeds,
+                           seeds.child('evaluation').record())
+    sys.stderr.write('\n')
+
+    for role, policy in zip(ROLES, policies):
+        torch.save(policy.network.state_dict(), os.path.join(output, role + '.pt'))
+
+    elapsed = time.time() - start
+    return {'mode' : 'train', 'seed' : seeds.record(), 'config' : config, 'history' : history,
+            'checkpoints' : [os.path.join(output, role + '.pt') for role in ROLES[:len(policies)]],
+            'elapsed' : elapsed, 'episodes_per_second' : num_episodes / elapsed}
+
+
+def run_job(job):
+    output = job.get('output', 'results')
+    os.makedirs(output, exist_ok = True)
+    mode = job.get('mode', 'evaluate')
+    if mode in ('evaluate', 'simulate'):
+        results = run_simulations(job, output)
+    elif mode == 'train':
+        results = run_training(job, output)
+    else:
+        raise ValueError('Unknown mode {0!r}'.format(mode))
+
+    results['job'] = job
+    with open(os.path.join(output, 'results.json'), 'w') as f:
+        json.dump(results, f, indent = 1)
+    return results
+
+
+def main(argv = None):
+    parser = argparse.ArgumentParser(description = 'Run beer game simulation, evaluation or training jobs headlessly.')
+    parser.add_argument('jobs', help = 'JSON file holding a job spec or a list of job specs')
+    parser.add_argument('--workers', type = int, help = 'override the number of worker processes')
+    parser.add_argument('--output', help = 'override the output directory (single job only)')
+    args = parser.parse_args(argv)
+
+    with open(args.jobs) as f:
+        jobs = json.load(f)
+    if isinstance(jobs, dict):
+        jobs = [jobs]
+    if args.output and len(jobs) > 1:
+        parser.error('--output needs a single job')
+
+    for i, job in enumerate(jobs):
+        if args.workers:
+            job['workers'] = args.workers
+        if args.output:
+            job['output'] = args.output
+        sys.stderr.write('JOB {0}/{1} : {2} -> {3}\n'.format(i + 1, len(jobs), job.get('mode', 'evaluate'), job.get('output', 'results')))
+        results = run_job(job)
+        if 'total_cost' in results:
+            # One total per structure of a cost grid.
+            total = np.round(results['total_cost'], 1)
+            print('{0} : total cost {1} ({2:.1f} runs/s)'.format(job.get('output', 'results'), total,
+                                                              results['runs_per_second']))
+        else:
+            print('{0} : trained in {1:.1f}s'.format(job.get('output', 'results'), results['elapsed']))
+
+
+if __name__ == '__main__':
+    main()
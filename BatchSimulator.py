@@ -0,0 +1,478 @@
+"""
+-------------------------------------------------------
+This file contains and defines the BatchSimulator and
+LookaheadPolicy classes.
+-------------------------------------------------------
+The BatchSimulator plays a batch of beer games side by side
+with NumPy arrays, one row per game. It follows the Players.py
+turn order exactly: each actor receives its delivery, then its
+orders, builds its state, ships, orders and pays, before the
+next actor plays. A queue that is full drops what is pushed
+into it, and negative deliveries or orders are not added.
+Queue lengths only depend on the number of pushes and pops,
+never on the values, so every game of a batch shares them.
+-------------------------------------------------------
+"""
+
+import numpy as np
+
+from SupplyChainActor import CostModel, N_ACTORS
+
+
+def batch_orders(policy, states):
+    """
+    -------------------------------------------------------
+    Returns a policy's decisions for a batch of state windows.
+    -------------------------------------------------------
+    Preconditions: policy - an object with calculate_orders(states),
+            or at least calculate_order(state).
+        states - a (batch, nstates, 5) array.
+    Postconditions: Returns (orders, actions) arrays of batch values,
+        actions being -1 for rule-based policies. Policies without
+        calculate_orders are called once per row.
+    -------------------------------------------------------
+    """
+    if hasattr(policy, 'calculate_orders'):
+        orders, actions = policy.calculate_orders(states)
+    else:
+        decisions = [policy.calculate_order(state.tolist()) for state in states]
+        orders = [order for order, _ in decisions]
+        actions = [action for _, action in decisions]
+        actions = None if all(action is None for action in actions) else [-1 if a is None else a for a in actions]
+    actions = np.full(len(states), -1) if actions is None else np.asarray(actions, dtype = np.int64)
+    return np.asarray(orders, dtype = np.float64), actions
+
+
+class BatchQueue:
+
+    def __init__(self, batch, queueLength):
+        """
+        -------------------------------------------------------
+        Constructor for the BatchQueue class, a SupplyChainQueue
+        holding one envelope per game of a batch.
+        -------------------------------------------------------
+        Preconditions: batch - the number of games.
+            queueLength - the length of the queue.
+        Postconditions: Initializes an empty ring buffer.
+        -------------------------------------------------------
+        """
+        self.queueLength = queueLength
+        self.data = np.zeros((batch, max(queueLength, 1)))
+        self.head = 0
+        self.length = 0
+        # Sum of the envelopes in the queue, per game.
+        self.total = np.zeros(batch)
+        return
+
+    def PushEnvelope(self, values):
+        # Like SupplyChainQueue, a full queue drops the envelope.
+        if self.length >= self.queueLength:
+            return False
+        self.data[:, (self.head + self.length) % self.queueLength] = values
+        self.total += values
+        self.length += 1
+        return True
+
+    def PopEnvelope(self):
+        if self.length == 0:
+            return np.zeros(len(self.data))
+        values = self.data[:, self.head].copy()
+        self.total -= values
+        self.head = (self.head + 1) % self.queueLength
+        self.length -= 1
+        return values
+
+    def Front(self):
+        # The values of data[:1], None for an empty queue.
+        return self.data[:, self.head] if self.length > 0 else None
+
+    def Load(self, envelopes):
+        """
+        -------------------------------------------------------
+        Replaces the content of the queue.
+        -------------------------------------------------------
+        Preconditions: envelopes - a SupplyChainQueue data list, oldest
+            first, shared by every game.
+        Postconditions: The queue holds envelopes.
+        -------------------------------------------------------
+        """
+        self.head = 0
+        self.length = len(envelopes)
+        self.data[:, :self.length] = envelopes
+        self.total[:] = np.sum(envelopes)
+        return
+
+
+##############################################################################################
+
+
+class BatchSimulator:
+
+    def __init__(self, demand, initial_orders = 5, initial_stock = 30, queue_delay_weeks = 2, cost_model = None, nstates = 10,
+                 extended_state = False):
+        """
+        -------------------------------------------------------
+        Constructor for the BatchSimulator class.
+        -------------------------------------------------------
+        Preconditions: demand - a (batch, weeks) array of customer
+                orders, one row per game. A (weeks,) array plays a
+                single game.
+            initial_orders, initial_stock, queue_delay_weeks - as for
+                beer_game_Simulator.
+            cost_model - the CostModel, the default unit costs if None.
+                A grid is priced in the same pass : the costs then have
+                its gridShape axes in front, e.g. gridShape + (batch, 4).
+            nstates - the number of weeks in a state window.
+            extended_state - as for beer_game_Simulator : state rows
+                also hold the on-order pipeline and inventory position.
+        Postconditions:
+            Initializes the BatchSimulator. init_simulation must be
+            called before playing.
+        -------------------------------------------------------
+        """
+        self.demand = np.atleast_2d(np.asarray(demand, dtype = np.float64))
+        self.batch, self.weeks_to_play = self.demand.shape
+
+        self.initial_orders = initial_orders
+        self.initial_stock = initial_stock
+        self.queue_delay_weeks = queue_delay_weeks
+        self.nstates = nstates
+        self.extended_state = extended_state
+        self.stateWidth = 7 if extended_state else 5
+
+        self.cost_model = CostModel() if cost_model is None else cost_model
+        return
+
+    def init_simulation(self, policy_retailer, policy_wholesaler, policy_distributor, policy_factory):
+        """
+        -------------------------------------------------------
+        Resets every game to the initial position.
+        -------------------------------------------------------
+        Preconditions: the policies - objects with calculate_orders
+            (or calculate_order), see batch_orders.
+        Postconditions: Every queue holds queue_delay_weeks envelopes of
+            initial_orders. The per-actor arrays below are (batch, 4),
+            in retailer to factory order, and mirror the attributes of
+            the SupplyChainActor objects. The cost arrays have the cost
+            model's gridShape axes in front.
+        -------------------------------------------------------
+        """
+        B = self.batch
+        self.policies = [policy_retailer, policy_wholesaler, policy_distributor, policy_factory]
+
+        # orderQueues[k] carries the orders of actor k, the last one being the
+        # factory production queue. deliveryQueues[k] carries the shipments to
+        # actor k from the actor above it.
+        self.orderQueues = [BatchQueue(B, self.queue_delay_weeks) for _ in range(N_ACTORS)]
+        self.deliveryQueues = [BatchQueue(B, self.queue_delay_weeks) for _ in range(N_ACTORS - 1)]
+        for queue in self.orderQueues + self.deliveryQueues:
+            for _ in range(self.queue_delay_weeks):
+                queue.PushEnvelope(self.initial_orders)
+
+        self.currentStock = np.full((B, N_ACTORS), float(self.initial_stock))
+        self.currentOrders = np.zeros((B, N_ACTORS))
+        self.costsIncurred = np.zeros(self.cost_model.gridShape + (B, N_ACTORS))
+        self.lastOrderQuantity = np.zeros((B, N_ACTORS))
+        self.lastCost = np.zeros(self.cost_model.gridShape + (B, N_ACTORS))
+        self.lastActions = np.full((B, N_ACTORS), -1)
+        self.newOrders = np.zeros((B, N_ACTORS))
+        self.lostSales = np.zeros((B, N_ACTORS))
+        self.lostThisTurn = np.zeros((B, N_ACTORS))
+        self.customerReceived = np.zeros(B)
+
+        self.cumulativeOrdered = np.zeros((B, N_ACTORS))
+        self.cumulativeReceived = np.zeros((B, N_ACTORS))
+        self.cumulativeShipped = np.zeros((B, N_ACTORS))
+        self.onOrder = np.stack([self.orderQueues[k].total + (self.deliveryQueues[k].total if k < N_ACTORS - 1 else 0)
+                                 for k in range(N_ACTORS)], axis = 1)
+
+        # The state windows, padded with -1 rows like TakeTurn does.
+        self.states = np.full((N_ACTORS, B, self.nstates, self.stateWidth), -1.)
+
+        self.weekt = 0
+        # Week whose customer orders are in demand[:, 0].
+        self.demand_start = 0
+        # Actor which began its turn and waits for its order, None between weeks.
+        self.pending = None
+        return
+
+    @classmethod
+    def from_simulator(cls, simulator, demand, policies, pending = None):
+        """
+        -------------------------------------------------------
+        Builds a batch of games that all start from the current
+        position of a beer_game_Simulator.
+        -------------------------------------------------------
+        Preconditions: simulator - a beer_game_Simulator in play.
+            demand - a (batch, weeks) array of the customer orders of
+                the weeks after the current one.
+            policies - the four batch policies to continue with.
+            pending - the index of the actor whose turn is under way,
+                i.e. which is calling its policy right now, or None
+                between weeks.
+        Postconditions: Returns a BatchSimulator holding a copy of the
+            stocks, orders, costs, queues and state windows. When
+            pending is set, step(orders) finishes the current week.
+        -------------------------------------------------------
+        """
+        engine = cls(demand, simulator.initial_orders, simulator.initial_stock, simulator.queue_delay_weeks,
+                     simulator.cost_model, simulator.nstates, simulator.extended_state)
+        engine.init_simulation(*policies)
+
+        actors = (simulator.myRetailer, simulator.myWholesaler, simulator.myDistributor, simulator.myFactory)
+        for k, actor in enumerate(actors):
+            engine.currentStock[:, k] = actor.currentStock
+            engine.currentOrders[:, k] = actor.currentOrders
+            engine.costsIncurred[..., k] = np.asarray(actor.costsIncurred)[..., None]
+            engine.lastOrderQuantity[:, k] = actor.lastOrderQuantity
+            engine.lostSales[:, k] = actor.lostSales
+            engine.lostThisTurn[:, k] = actor.lostThisTurn
+            engine.cumulativeOrdered[:, k] = actor.cumulativeOrdered
+            engine.cumulativeReceived[:, k] = actor.cumulativeReceived
+            engine.cumulativeShipped[:, k] = actor.cumulativeShipped
+            engine.onOrder[:, k] = actor.onOrder
+            rows = [list(row) + [0] * (engine.stateWidth - len(row)) for row in actor.states]
+            if rows:
+                engine.states[k, :, -len(rows):] = rows
+
+            engine.orderQueues[k].Load(actor.outgoingOrdersQueue.data if k < N_ACTORS - 1 else actor.BeerProductionDelayQueue.data)
+            if k < N_ACTORS - 1:
+                engine.deliveryQueues[k].Load(actor.incomingDeliveriesQueue.data)
+
+        engine.customerReceived[:] = simulator.theCustomer.totalBeerReceived
+        engine.weekt = simulator.weekt
+        engine.demand_start = simulator.weekt if pending is None else simulator.weekt + 1
+        engine.pending = pending
+        return engine
+
+    def _BeginTurn(self, k):
+        # Receive, build the state and ship : TakeTurn up to PlaceOutgoingOrder.
+        old_stock = self.currentStock[:, k].copy()
+        if k < N_ACTORS - 1:
+            new_shipment = self.deliveryQueues[k].PopEnvelope()
+        else:
+            new_shipment = self.orderQueues[k].PopEnvelope()
+        received = np.maximum(new_shipment, 0)
+        self.currentStock[:, k] += received
+        self.cumulativeReceived[:, k] += received
+        self.onOrder[:, k] -= received
+
+        old_orders = self.currentOrders[:, k].copy()
+        if k == 0:
+            # The retailer adds the customer's order whatever its sign.
+            new_orders = self.demand[:, self.weekt - self.demand_start]
+            self.currentOrders[:, k] += new_orders
+        else:
+            new_orders = self.orderQueues[k - 1].PopEnvelope()
+            self.currentOrders[:, k] += np.maximum(new_orders, 0)
+        self.newOrders[:, k] = new_orders
+
+        # An empty queue leaves the last state entry out in TakeTurn; it is 0 here.
+        in_transit = self.orderQueues[k].Front()
+        row = [old_stock, new_shipment, old_orders, new_orders, np.zeros(self.batch) if in_transit is None else in_transit]
+        if self.extended_state:
+            row += [self.onOrder[:, k], self.currentStock[:, k] - self.currentOrders[:, k] + self.onOrder[:, k]]
+        states = self.states[k]
+        states[:, :-1] = states[:, 1:]
+        states[:, -1] = np.stack(row, axis = 1)
+
+        delivery = self._CalcBeerToDeliver(k)
+        if k == 0:
+            self.customerReceived += delivery
+        else:
+            self.deliveryQueues[k - 1].PushEnvelope(delivery)
+        return
+
+    def _CalcBeerToDeliver(self, k):
+        stock, orders = self.currentStock[:, k], self.currentOrders[:, k]
+        fill = stock >= orders
+        partial = ~fill & (stock >= 0)
+        delivery = np.where(fill, orders, np.where(partial, stock, 0.))
+        self.currentStock[:, k] = np.where(fill, stock - orders, np.where(partial, 0., stock))
+        self.currentOrders[:, k] = orders - delivery
+        self.cumulativeShipped[:, k] += delivery
+
+        self.lostThisTurn[:, k] = 0
+        if self.cost_model.lostSales:
+            lost = np.maximum(self.currentOrders[:, k], 0)
+            self.lostThisTurn[:, k] = lost
+            self.lostSales[:, k] += lost
+            self.currentOrders[:, k] -= lost
+            # The lost units will never reach the downstream actor.
+            if k > 0:
+                self.onOrder[:, k - 1] -= lost
+        return delivery
+
+    def _CompleteTurn(self, k, orders = None):
+        # Order and pay : the end of TakeTurn.
+        if orders is None:
+            orders, actions = batch_orders(self.policies[k], self.states[k])
+        else:
+            actions = np.full(self.batch, -1)
+        orders = np.broadcast_to(np.asarray(orders, dtype = np.float64), (self.batch,))
+
+        if self.orderQueues[k].PushEnvelope(orders):
+            placed = np.maximum(orders, 0)
+            self.cumulativeOrdered[:, k] += placed
+            self.onOrder[:, k] += placed
+        self.lastOrderQuantity[:, k] = orders
+        self.lastActions[:, k] = actions
+
+        unfilled = self.lostThisTurn[:, k] if self.cost_model.lostSales else self.currentOrders[:, k]
+        if self.cost_model.scalarParameters is not None:
+            holding, penalty, holdingExponent, penaltyExponent = self.cost_model.scalarParameters[k]
+            self.lastCost[:, k] = holding * self.currentStock[:, k] ** holdingExponent + penalty * unfilled ** penaltyExponent
+        else:
+            holding, penalty, holdingExponent, penaltyExponent = (p[..., None] for p in self.cost_model.ForActor(k))
+            self.lastCost[..., k] = (holding * np.power(self.currentStock[:, k], holdingExponent)
+                                     + penalty * np.power(unfilled, penaltyExponent))
+        self.costsIncurred[..., k] += self.lastCost[..., k]
+        return
+
+    def step(self, orders = None):
+        """
+        -------------------------------------------------------
+        Plays one week of every game.
+        -------------------------------------------------------
+        Preconditions: orders - if an actor's turn is pending, the
+            orders it places instead of asking its policy (a scalar
+            or batch values). Ignored otherwise.
+        Postconditions: The week is over for all four actors. Returns
+            the (batch, 4) costs of the week, preceded by the gridShape
+            axes of a cost model grid.
+        -------------------------------------------------------
+        """
+        first = 0
+        if self.pending is not None:
+            first = self.pending + 1
+            self._CompleteTurn(self.pending, orders)
+            self.pending = None
+
+        for k in range(first, N_ACTORS):
+            self._BeginTurn(k)
+            self._CompleteTurn(k)
+
+        self.weekt += 1
+        return self.lastCost
+
+    def remaining_weeks(self):
+        # Counts a pending week as one.
+        return self.weeks_to_play - (self.weekt - self.demand_start)
+
+    def run_simulation(self, record = False):
+        """
+        -------------------------------------------------------
+        Plays every game until its demand runs out.
+        -------------------------------------------------------
+        Preconditions: record - whether to keep the weekly trajectories.
+        Postconditions: Returns the (batch, 4) costs incurred, preceded
+            by the gridShape axes of a cost model grid. With
+            record, also returns a dict of (batch, weeks, 4) arrays in
+            the SupplyChainAnalytics layout : demand (orders received),
+            orders (placed), stock, backorders, lost (units lost this
+            week under lost sales), cost (cumulative), on_order
+            (pipeline) and action (-1 for rule-based policies).
+        -------------------------------------------------------
+        """
+        weeks = self.remaining_weeks()
+        if record:
+            names = ('demand', 'orders', 'stock', 'backorders', 'lost', 'cost', 'on_order', 'action')
+            history = {name : np.empty((self.cost_model.gridShape if name == 'cost' else ()) + (self.batch, weeks, N_ACTORS),
+                                       dtype = np.int64 if name == 'action' else np.float64)
+                       for name in names}
+
+        for week in range(weeks):
+            self.step()
+            if record:
+                for name, values in zip(names, (self.newOrders, self.lastOrderQuantity, self.currentStock,
+                                                self.currentOrders, self.lostThisTurn, self.costsIncurred, self.onOrder,
+                                                self.lastActions)):
+                    history[name][..., week, :] = values
+
+        return (self.costsIncurred, history) if record else self.costsIncurred
+
+
+##############################################################################################
+
+
+class LookaheadPolicy:
+
+    def __init__(self, simulator, actor = 0, horizon = 8, rollout_policies = None, n_actions = 30, budget = 50000,
+                 demand_sampler = None, rng = None):
+        """
+        -------------------------------------------------------
+        Constructor for the LookaheadPolicy class, a model-predictive
+        policy for one actor of a beer_game_Simulator.
+        -------------------------------------------------------
+        Preconditions: simulator - the beer_game_Simulator the policy
+                plays in. The rollouts start from its current position.
+            actor - the index of the actor the policy plays, 0 (retailer)
+                to 3 (factory).
+            horizon - the number of weeks simulated after the current
+                one.
+            rollout_policies - the four batch policies playing during the
+                rollouts, including the actor's later weeks. Defaults to
+                OrderPolicy(initial_stock) everywhere.
+            n_actions - the candidate orders are those of DQN_Policy :
+                last shipment + action - n_actions/2 for every action in
+                range(n_actions) (DQN.MAX_ACTIONS is 30).
+            budget - the per-decision compute budget, in simulated
+                chain-weeks. The number of demand samples per candidate
+                is budget // (n_actions * (horizon + 1)), at least 1.
+            demand_sampler - called as demand_sampler(rng, n_samples,
+                horizon); returns a (n_samples, horizon) array. By default
+                the customer orders seen by the retailer in its state
+                window are bootstrapped.
+            rng - the numpy Generator for the demand samples.
+        Postconditions:
+            Initializes the LookaheadPolicy object.
+        -------------------------------------------------------
+        """
+        if simulator.cost_model is not None and simulator.cost_model.gridShape != ():
+            raise ValueError('LookaheadPolicy minimizes a single cost structure, not a grid of {0}'.format(
+                             simulator.cost_model.gridShape))
+        self.simulator = simulator
+        self.actor = actor
+        self.horizon = horizon
+        self.rollout_policies = rollout_policies
+        self.n_actions = n_actions
+        self.budget = budget
+        self.demand_sampler = demand_sampler
+        self.rng = np.random.default_rng() if rng is None else rng
+        return
+
+    def _sample_demand(self, n_samples):
+        if self.demand_sampler is not None:
+            return np.asarray(self.demand_sampler(self.rng, n_samples, self.horizon), dtype = np.float64)
+        seen = [row[3] for row in self.simulator.myRetailer.states]
+        return self.rng.choice(np.asarray(seen, dtype = np.float64), (n_samples, self.horizon))
+
+    def calculate_order(self, state):
+        """
+        -------------------------------------------------------
+        Picks the candidate order with the lowest expected chain cost.
+        -------------------------------------------------------
+        Preconditions: state - the actor's (nstates, 5) state window;
+            the actor is in the middle of its turn in self.simulator.
+        Postconditions: Returns (amountToOrder, action). Every candidate
+            is rolled out against the same demand samples, and the
+            whole chain cost of the current week and the next horizon
+            weeks is averaged over them.
+        -------------------------------------------------------
+        """
+        if self.rollout_policies is None:
+            from BeerGameSimulator import OrderPolicy
+            self.rollout_policies = [OrderPolicy(self.simulator.initial_stock)] * N_ACTORS
+
+        candidates = state[-1][1] + np.arange(self.n_actions) - int(self.n_actions/2)
+        n_samples = max(1, self.budget // (self.n_actions * (self.horizon + 1)))
+        demand = np.tile(self._sample_demand(n_samples), (self.n_actions, 1))
+
+        engine = BatchSimulator.from_simulator(self.simulator, demand, self.rollout_policies, pending = self.actor)
+        sunk = engine.costsIncurred.sum(axis = 1)
+        engine.step(np.repeat(candidates, n_samples))
+        engine.run_simulation()
+
+        costs = (engine.costsIncurred.sum(axis = 1) - sunk).reshape(self.n_actions, n_samples).mean(axis = 1)
+        action = int(np.argmin(costs))
+        return candidates[action], action
@@ -0,0 +1,369 @@
+"""
+-------------------------------------------------------
+This file contains and defines the beer_game_Simulator and
+OrderPolicy classes.
+-------------------------------------------------------
+Importing it only needs NumPy. The torch policies and the
+demand loaders can be imported from here too, but their modules
+are only loaded the first time they are asked for.
+-------------------------------------------------------
+"""
+
+import copy
+import importlib
+
+from Players import Customer, Retailer, Wholesaler, Distributor, Factory
+from SupplyChainActor import SupplyChainQueue
+from SupplyChainStatistics import SupplyChainStatistics, WindowedSupplyChainStatistics
+import numpy as np
+
+
+VERBOSE = False
+
+
+_LAZY_ATTRIBUTES = {'DQN' : 'DQN' , 'DQN_Policy' : 'DQN' , 'ReplayMemory' : 'DQN' , 'OfflineMemory' : 'DQN' ,
+                    'load_sales_demand' : 'Demand' , 'csv_demand' : 'Demand' , 'periodic_demand' : 'Demand'}
+
+
+def __getattr__(name):
+    # Module-level fallback : resolves the lazy names on first use and caches them.
+    if name not in _LAZY_ATTRIBUTES:
+        raise AttributeError("module {0!r} has no attribute {1!r}".format(__name__ , name))
+    value = getattr(importlib.import_module(_LAZY_ATTRIBUTES[name]) , name)
+    globals()[name] = value
+    return value
+
+
+class beer_game_Simulator:
+    
+    def __init__(self, customer, initial_orders , initial_stock, queue_delay_weeks = 2 , cost_model = None , seeds = None ,
+                 extended_state = False):
+        
+        #A copy of its own : init_simulation reseeds it, which must neither touch the caller's
+        #customer nor the other simulators built from it.
+        self.theCustomer = copy.copy(customer)
+        # Streamed demand has no known length : weeks_to_play is then None.
+        self.weeks_to_play = len(self.theCustomer.orders) if self.theCustomer.stream is None else None
+        
+        self.queue_delay_weeks = queue_delay_weeks
+        self.nstates = 10
+        
+        self.initial_orders = initial_orders
+        self.initial_stock = initial_stock
+        
+        # CostModel shared by the four actors, None for the default unit costs.
+        self.cost_model = cost_model
+        
+        # SeedManager : each simulation then draws its demand noise from its own stream.
+        self.seeds = seeds
+        self.n_simulations = 0
+        self.simulation_seed = None
+        
+        # Adds the on-order pipeline and the inventory position to every state row (7 entries instead of 5).
+        self.extended_state = extended_state
+        self.stateWidth = 7 if extended_state else 5
+        
+    
+    def init_simulation(self , policy_retailer , policy_wholesaler , policy_distributor , policy_factory):
+
+        """
+        -------------------------------------------------------
+        Given two SupplyChainActors B <--> A, where
+        A is higher in the supply chain, let "top queue" denote A's
+        outgoingOrderQueue/B's incomingOrderQueue. Let "bottom queue"
+        denote B's outgoingDeliveryQueue/A's incoming delivery queue. 
+        -------------------------------------------------------
+        """
+        wholesalerRetailerTopQueue = SupplyChainQueue(self.queue_delay_weeks)
+        wholesalerRetailerBottomQueue = SupplyChainQueue(self.queue_delay_weeks)
+
+        distributorWholesalerTopQueue = SupplyChainQueue(self.queue_delay_weeks)
+        distributorWholesalerBottomQueue = SupplyChainQueue(self.queue_delay_weeks)
+
+        factoryDistributorTopQueue = SupplyChainQueue(self.queue_delay_weeks)
+        factoryDistributorBottomQueue = SupplyChainQueue(self.queue_delay_weeks)
+        factoryProductionDelayQueue = SupplyChainQueue(self.queue_delay_weeks)
+
+        self.theCustomer.Restart()
+        if self.seeds is not None:
+            seeds = self.seeds.child('simulation' , self.n_simulations)
+            self.theCustomer.rng = seeds.generator()
+            self.simulation_seed = seeds.record()
+        self.n_simulations += 1
+
+        """
+        -------------------------------------------------------
+        Each queue should have at least 2 orders of size CUSTOMER_INITIAL_ORDER 
+        -------------------------------------------------------
+        """
+        for i in range(self.queue_delay_weeks):
+            
+            wholesalerRetailerTopQueue.PushEnvelope(self.initial_orders)
+            wholesalerRetailerBottomQueue.PushEnvelope(self.initial_orders)
+
+            distributorWholesalerTopQueue.PushEnvelope(self.initial_orders)
+            distributorWholesalerBottomQueue.PushEnvelope(self.initial_orders)
+
+            factoryDistributorTopQueue.PushEnvelope(self.initial_orders)
+            factoryDistributorBottomQueue.PushEnvelope(self.initial_orders)
+            #We assume that the factory already has some runs in production. This is in the rules, and ensures initial stability.
+            factoryProductionDelayQueue.PushEnvelope(self.initial_orders)
+
+
+        """
+        -------------------------------------------------------
+        Now we initialize our SupplyChainObjects. Passing the correct
+        queues is essential.
+        -------------------------------------------------------
+        """
+
+
+        self.myRetailer = Retailer(policy_retailer ,self.nstates , self.initial_stock,
+                                   None, wholesalerRetailerTopQueue, wholesalerRetailerBottomQueue,
+                              None, self.theCustomer, self.cost_model, self.extended_state)
+
+        self.myWholesaler = Wholesaler(policy_wholesaler ,self.nstates , self.initial_stock ,
+                                       wholesalerRetailerTopQueue, distributorWholesalerTopQueue,
+                                  distributorWholesalerBottomQueue, wholesalerRetailerBottomQueue, self.cost_model, self.extended_state)
+
+        self.myDistributor = Distributor(policy_distributor ,self.nstates , self.initial_stock ,
+                                         distributorWholesalerTopQueue, factoryDistributorTopQueue,
+                                    factoryDistributorBottomQueue, distributorWholesalerBottomQueue, self.cost_model, self.extended_state)
+
+        self.myFactory = Factory(policy_factory ,self.nstates , self.initial_stock,
+                                 factoryDistributorTopQueue, None, None, factoryDistributorBottomQueue, 
+                            factoryProductionDelayQueue, self.cost_model, self.extended_state)
+
+        #Each actor ships to the one below it; the retailer ships to the customer.
+        self.myWholesaler.downstream = self.myRetailer
+        self.myDistributor.downstream = self.myWholesaler
+        self.myFactory.downstream = self.myDistributor
+
+        #Initialize Statistics object
+        self.myStats = SupplyChainStatistics()
+        
+        self.weekt = 0
+        
+        
+    def step(self):
+        
+        res = {'retailer' : {} ,
+              'wholesaler' : {} ,
+              'distributor' : {} ,
+              'factory' : {} }
+        
+        #Retailer takes turn, update stats
+        res['retailer']['state'] , res['retailer']['action'] , res['retailer']['reward'] = self.myRetailer.TakeTurn(self.weekt)
+
+        
+        #Wholesaler takes turn, update stats
+        res['wholesaler']['state'] , res['wholesaler']['action'] , res['wholesaler']['reward'] = self.myWholesaler.TakeTurn(
+                                                                                                        self.weekt)
+
+
+        #Distributor takes turn, update stats
+        res['distributor']['state'] , res['distributor']['action'] , res['distributor']['reward'] = (self.
+                                                                                    myDistributor.TakeTurn(self.weekt))
+
+
+        #Factory takes turn, update stats
+        res['factory']['state'] , res['factory']['action'] , res['factory']['reward'] = self.myFactory.TakeTurn(self.weekt)
+        
+        self.weekt += 1 
+        
+        return res
+        
+        
+    
+    def play_week(self , weekNum):
+        
+        """
+        -------------------------------------------------------
+        Every actor takes its turn for week weekNum, and the
+        statistics object records the outcome.
+        -------------------------------------------------------
+        """
+        if VERBOSE: print("--- Week {0} ---".format(weekNum))
+
+        #Retailer takes turn, update stats
+        _ = self.myRetailer.TakeTurn(weekNum)
+        self.myStats.RecordRetailerCost(self.myRetailer.GetCostIncurred())
+        self.myStats.RecordRetailerOrders(self.myRetailer.GetLastOrderQuantity())
+        self.myStats.RecordRetailerEffectiveInventory(self.myRetailer.CalcEffectiveInventory())
+        if VERBOSE: print("Retailer Complete")
+
+        #Wholesaler takes turn, update stats
+        _ = self.myWholesaler.TakeTurn(weekNum)
+        self.myStats.RecordWholesalerCost(self.myWholesaler.GetCostIncurred())
+        self.myStats.RecordWholesalerOrders(self.myWholesaler.GetLastOrderQuantity())
+        self.myStats.RecordWholesalerEffectiveInventory(self.myWholesaler.CalcEffectiveInventory())
+        if VERBOSE: print("Wholesaler Complete")
+
+        #Distributor takes turn, update stats
+        _ = self.myDistributor.TakeTurn(weekNum)
+        self.myStats.RecordDistributorCost(self.myDistributor.GetCostIncurred())
+        self.myStats.RecordDistributorOrders(self.myDistributor.GetLastOrderQuantity())
+        self.myStats.RecordDistributorEffectiveInventory(self.myDistributor.CalcEffectiveInventory())
+        if VERBOSE: print("Distributor Complete")
+
+        #Factory takes turn, update stats
+        _ = self.myFactory.TakeTurn(weekNum)
+        self.myStats.RecordFactoryCost(self.myFactory.GetCostIncurred())
+        self.myStats.RecordFactoryOrders(self.myFactory.GetLastOrderQuantity())
+        self.myStats.RecordFactoryEffectiveInventory(self.myFactory.CalcEffectiveInventory())
+        if VERBOSE: print("Factory Complete")
+        
+        #Same week counter as step().
+        self.weekt = weekNum + 1
+        
+        
+    def run_simulation(self , vis = True):
+
+        if self.weeks_to_play is None:
+            raise ValueError("The customer's demand is streamed and has no length : play it with run_stream() instead of run_simulation()")
+
+        for thisWeek in range(0, self.weeks_to_play):
+            self.play_week(thisWeek)
+
+
+        if vis:
+            print("--- Final Statistics ----")
+            print("Beer received by customer: {0}".format(self.theCustomer.GetBeerReceived()))
+            
+            print('Retailer Cost :' , self.myStats.retailerCostsOverTime[-1])
+            print('Wholesaler Cost :' , self.myStats.wholesalerCostsOverTime[-1])
+            print('Distributor Cost :' , self.myStats.distributorCostsOverTime[-1])
+            print('Factory Cost : ' , self.myStats.factoryCostsOverTime[-1])
+            print('Total Cost : ' , self.myStats.retailerCostsOverTime[-1] + self.myStats.wholesalerCostsOverTime[-1]
+                  + self.myStats.distributorCostsOverTime[-1]+self.myStats.factoryCostsOverTime[-1] )
+            
+            
+            self.myStats.PlotCosts()
+            self.myStats.PlotOrders()
+            self.myStats.PlotEffectiveInventory()
+            
+    def run_stream(self , window = 52 , sink = None , max_weeks = None):
+        """
+        -------------------------------------------------------
+        Plays until the customer's demand stream runs out (or for
+        max_weeks weeks), in constant memory.
+        -------------------------------------------------------
+        Preconditions: init_simulation was called. window, sink - see
+            WindowedSupplyChainStatistics; sink receives one summary
+            every window weeks.
+        Postconditions: Returns the WindowedSupplyChainStatistics, which
+            replaces self.myStats and holds the most recent windows.
+            A generator stream is single-use : see Customer.Restart.
+        -------------------------------------------------------
+        """
+        self.myStats = WindowedSupplyChainStatistics(window , sink)
+        
+        thisWeek = 0
+        while (max_weeks is None or thisWeek < max_weeks) and self.theCustomer.HasOrder(thisWeek):
+            self.play_week(thisWeek)
+            thisWeek += 1
+        
+        # Flush the last, incomplete window.
+        self.myStats.CloseWindow()
+        return self.myStats
+            
+    def run_multiple_simulations(self , n_sims , policies):
+        
+        rcosts , wcosts , dcosts , fcosts = [] , [] , [] , []
+        
+        for _ in range(n_sims):
+            
+            self.init_simulation(*policies)
+            self.run_simulation(vis = False)
+                
+            rcosts.append(self.myStats.retailerCostsOverTime[-1])
+            wcosts.append(self.myStats.wholesalerCostsOverTime[-1])
+            dcosts.append(self.myStats.distributorCostsOverTime[-1])
+            fcosts.append(self.myStats.factoryCostsOverTime[-1])
+        
+        print('Number of Simulations : ', n_sims)
+        print('--------------------------------')
+        # Averages over the simulations only : a CostModel grid keeps one mean per structure.
+        print('Retailer Cost : ', np.mean(rcosts , axis = 0))
+        print('Wholesaler Cost : ', np.mean(wcosts , axis = 0))
+        print('Distributor Cost : ', np.mean(dcosts , axis = 0))
+        print('Factory Cost : ', np.mean(fcosts , axis = 0))
+        print('--------------------------------')
+        print('Total Cost : ' , np.mean(rcosts , axis = 0)+np.mean(wcosts , axis = 0) +np.mean(dcosts , axis = 0)
+              + np.mean(fcosts , axis = 0) )
+
+    def evaluate_costs(self , n_sims , policies):
+        """
+        -------------------------------------------------------
+        Returns the mean cost of each actor over n_sims runs.
+        -------------------------------------------------------
+        Preconditions: policies - the retailer, wholesaler, distributor
+            and factory policies. Like update_costs, policies with a
+            train flag are evaluated greedily and switched back after.
+        Postconditions: Returns [retailer, wholesaler, distributor,
+            factory] mean costs, each an array of the cost model's
+            gridShape when it holds a grid.
+        -------------------------------------------------------
+        """
+        training = [getattr(pol , 'train' , None) for pol in policies]
+        for pol in policies:
+            if hasattr(pol , 'train'): pol.train = False
+
+        gridShape = () if self.cost_model is None else self.cost_model.gridShape
+        costs = np.zeros((4,) + gridShape)
+        for _ in range(n_sims):
+            self.init_simulation(*policies)
+            self.run_simulation(vis = False)
+            costs += [self.myRetailer.GetCostIncurred() , self.myWholesaler.GetCostIncurred() ,
+                      self.myDistributor.GetCostIncurred() , self.myFactory.GetCostIncurred()]
+
+        for pol , train in zip(policies , training):
+            if train is not None: pol.train = train
+
+        return list(costs / n_sims)
+
+
+        
+        
+# todo : add noise + parameter nweeks 
+# Step function (taketurns )
+    
+    
+class OrderPolicy:
+    
+    def __init__(self , target_stock):
+        self.target_stock = target_stock
+        
+    def calculate_order(self, state):
+    
+        #First weeks are in equilibrium
+        
+
+        currentOrders = state[-1][2] + state[-1][3]
+        currentStock = state[-1][0] + state[-1][1]
+        
+        #We want to cover any out flows, we know that there are some orders in the pipeline.
+        amountToOrder = np.ceil(0.5 * currentOrders)
+
+        if (self.target_stock - currentStock) > 0:
+            amountToOrder += self.target_stock - currentStock
+
+        return amountToOrder , None
+
+    def calculate_orders(self, states):
+        """
+        -------------------------------------------------------
+        Vectorized calculate_order over a batch of state windows.
+        -------------------------------------------------------
+        Preconditions: states - a (batch, nstates, 5) array.
+        Postconditions: Returns (amountsToOrder, None), the amounts
+            being the batch of calculate_order decisions.
+        -------------------------------------------------------
+        """
+        states = np.asarray(states , dtype = np.float64)
+        currentOrders = states[: , -1 , 2] + states[: , -1 , 3]
+        currentStock = states[: , -1 , 0] + states[: , -1 , 1]
+
+        amountsToOrder = np.ceil(0.5 * currentOrders) + np.maximum(self.target_stock - currentStock , 0)
+
+        return amountsToOrder , None
@@ -0,0 +1,379 @@
+"""
+-------------------------------------------------------
+This file contains the Deep Q-Network policy, its replay
+memories and the optimization step.
+-------------------------------------------------------
+ReplayMemory is filled online from simulator steps, while
+OfflineMemory samples transitions straight out of a trajectory
+store recorded with TrajectoryStore.TrajectoryWriter, so that
+a network can be trained without re-simulating anything.
+-------------------------------------------------------
+"""
+
+from collections import namedtuple
+import random
+import warnings
+
+import numpy as np
+import torch
+import torch.nn as nn
+import torch.nn.functional as F
+
+device = torch.device("cpu")
+#device = torch.device("cuda" if torch.cuda.is_available() else "cpu")
+
+
+MAX_ACTIONS = 30
+
+EPS_START = 0.9
+EPS_END = 0.05
+EPS_DECAY = 36500/2
+
+BATCH_SIZE = 32
+GAMMA = 1
+
+MAX_REWARD = -1000
+
+
+Transition = namedtuple('Transition', ('state', 'action', 'reward', 'next_state'))
+
+
+class ReplayMemory(object):
+
+    def __init__(self, capacity, rng = None):
+        self.capacity = capacity
+        self.memory = []
+        self.position = 0
+        # random.Random used to sample batches, the global one by default.
+        self.rng = random if rng is None else rng
+
+    def push(self, *args):
+        """Saves a transition."""
+        if len(self.memory) < self.capacity:
+            self.memory.append(None)
+        self.memory[self.position] = Transition(*args)
+        self.position = (self.position + 1) % self.capacity
+
+    def sample(self, batch_size):
+        return self.rng.sample(self.memory, batch_size)
+
+    def __len__(self):
+        return len(self.memory)
+
+
+class DQN(nn.Module):
+
+    def __init__(self, nstates = 10, width = 5):
+        # The input is an (nstates, width) state window : width is the simulator's
+        # stateWidth, 7 with the on-order pipeline and inventory position.
+        super(DQN, self).__init__()
+
+        self.fc1 = nn.Linear(nstates*width, 100)
+        self.fc2 = nn.Linear(100 , 130)
+        self.fc3 = nn.Linear(130 , 100)
+        self.fc4 = nn.Linear(100, MAX_ACTIONS)
+
+    def forward(self, x):
+        output = x.view(x.shape[0],-1 )
+        output = F.relu(self.fc1(output))
+        output = F.relu(self.fc2(output))
+        output = F.relu(self.fc3(output))
+        output = self.fc4(output)
+        return output
+
+
+########################
+class DQN_Policy:
+
+    def __init__(self , network , train = False , eps_decay = EPS_DECAY , rng = None):
+        self.network = network
+        self.train = train
+        self.n_steps = 0
+        self.eps_decay = eps_decay
+        # numpy Generator used for exploration, the global state by default.
+        self.rng = np.random if rng is None else rng
+
+    def calculate_order(self, array):
+
+        if self.train:
+            # Exploration :
+            pb_exploration = EPS_END + (EPS_START - EPS_END) * np.exp(-1. * self.n_steps / self.eps_decay)
+            if self.rng.random() <= pb_exploration:
+                action = int(self.rng.choice(MAX_ACTIONS))
+                return array[-1][1] + action - int(MAX_ACTIONS/2) , action
+
+
+        x = torch.tensor([array] , device = device , dtype = torch.float32)
+        q_values = self.network(x)
+        action = int(torch.argmax(q_values))
+
+        return array[-1][1] + action - int(MAX_ACTIONS/2) , action
+
+    def calculate_orders(self, states):
+        """
+        -------------------------------------------------------
+        Greedy decisions for a batch of state windows.
+        -------------------------------------------------------
+        Preconditions: states - a (batch, nstates, 5) array.
+        Postconditions: Returns (orders, actions) arrays computed in a
+            single forward pass. Exploration is not applied, whatever
+            the train flag.
+        -------------------------------------------------------
+        """
+        states = np.asarray(states)
+        with torch.no_grad():
+            q_values = self.network(torch.as_tensor(states , dtype = torch.float32 , device = device))
+        actions = q_values.argmax(1).cpu().numpy()
+
+        return self.order_from_action(states , actions) , actions
+
+    def order_from_action(self, states, actions):
+        # The order rule of calculate_order, for one window or a batch.
+        return np.asarray(states)[... , -1 , 1] + actions - int(MAX_ACTIONS/2)
+
+
+def order_to_action(orders, shipments):
+    """
+    -------------------------------------------------------
+    Inverts DQN_Policy's order rule.
+    -------------------------------------------------------
+    Preconditions: orders - order quantities placed by any policy.
+        shipments - the matching last-week shipments, state[-1][1].
+    Postconditions: Returns the action indices that would have placed
+        the closest order, clipped to [0, MAX_ACTIONS). Orders outside
+        shipments +- MAX_ACTIONS/2 have no action : see
+        action_in_range.
+    -------------------------------------------------------
+    """
+    actions = np.rint(np.asarray(orders) - np.asarray(shipments)) + int(MAX_ACTIONS/2)
+    return np.clip(actions, 0, MAX_ACTIONS - 1).astype(np.int64)
+
+
+def action_in_range(orders, shipments):
+    # Whether order_to_action maps the orders without clipping them.
+    actions = np.rint(np.asarray(orders) - np.asarray(shipments)) + int(MAX_ACTIONS/2)
+    return (actions >= 0) & (actions < MAX_ACTIONS)
+
+
+def transition_variables(ob, key):
+    return ob[key]['state'] , ob[key]['action'] , max(ob[key]['reward'] , MAX_REWARD)
+
+def to_tensors(variables):
+
+    # format : state , action , reward , new_state
+    tensors = [ torch.tensor([v], device=device , dtype = torch.float32) for v in variables ]
+    tensors[1] = tensors[1].view(1 , 1) # We adapt the action tensor shape.
+
+    return tensors
+
+
+##############################################################################################
+
+
+class OfflineMemory(object):
+
+    def __init__(self, reader, actor, max_reward = MAX_REWARD, rng = None):
+        """
+        -------------------------------------------------------
+        Constructor for the OfflineMemory class.
+        -------------------------------------------------------
+        Preconditions: reader - a TrajectoryReader whose records were
+                written week by week with TrajectoryWriter.record_step,
+                so that an actor's next week is len(reader.actors) rows
+                further down.
+            actor - the actor whose transitions are replayed.
+            max_reward - rewards are floored at this value, as in
+                transition_variables.
+            rng - the numpy Generator drawing the batches. Defaults to
+                the global np.random state.
+        Postconditions:
+            Counts the usable transitions in one pass over the store.
+            The columns themselves stay memory-mapped. Transitions of
+            rule-based policies whose order no action can place are
+            left out, since their reward belongs to the order actually
+            placed; a warning gives their number.
+        -------------------------------------------------------
+        """
+        self.reader = reader
+        self.actor = reader.actors.index(actor) if isinstance(actor, str) else actor
+        self.max_reward = max_reward
+        self.stride = len(reader.actors)
+        self.rng = np.random if rng is None else rng
+
+        self.n_transitions = 0
+        self.n_out_of_range = 0
+        for start in range(0, len(reader) - self.stride, 1 << 20):
+            stop = min(start + (1 << 20), len(reader) - self.stride)
+            rows = np.arange(start, stop)
+            transitions = self._transitions(rows)
+            valid = transitions & self._representable(rows)
+            self.n_transitions += int(valid.sum())
+            self.n_out_of_range += int((transitions & ~valid).sum())
+        if self.n_out_of_range:
+            warnings.warn('{0} of the {1} transitions of actor {2} place orders outside shipment +- {3} and are '
+                          'left out'.format(self.n_out_of_range, self.n_transitions + self.n_out_of_range,
+                                            reader.actors[self.actor], int(MAX_ACTIONS/2)))
+        return
+
+    def _transitions(self, rows):
+        episode, week, actor = self.reader['episode'], self.reader['week'], self.reader['actor']
+        nxt = rows + self.stride
+        return ((actor[rows] == self.actor) & (actor[nxt] == self.actor)
+                & (episode[rows] == episode[nxt]) & (week[nxt] == week[rows] + 1))
+
+    def _representable(self, rows):
+        # Logged actions are kept; a rule-based order needs an action placing it exactly.
+        logged = self.reader['action'][rows] >= 0
+        return logged | action_in_range(self.reader['order'][rows], self.reader['state'][rows, -1, 1])
+
+    def _valid(self, rows):
+        return self._transitions(rows) & self._representable(rows)
+
+    def __len__(self):
+        return self.n_transitions
+
+    def sample_rows(self, batch_size):
+        """
+        -------------------------------------------------------
+        Draws row indices of valid transitions uniformly at random.
+        -------------------------------------------------------
+        Preconditions: batch_size - the number of rows to draw.
+        Postconditions: Returns an index array. Rows are drawn over the
+            whole store and rejected until batch_size of them start a
+            transition of self.actor, so no index of the dataset is
+            ever built in memory.
+        -------------------------------------------------------
+        """
+        if self.n_transitions == 0:
+            raise ValueError('No transition of actor {0} in the store'.format(self.reader.actors[self.actor]))
+        rows = np.empty(0, dtype = np.int64)
+        while len(rows) < batch_size:
+            draw = self.rng.integers if hasattr(self.rng, 'integers') else self.rng.randint
+            candidates = draw(0, len(self.reader) - self.stride, size = 4 * batch_size)
+            rows = np.concatenate([rows, candidates[self._valid(candidates)]])
+        return rows[:batch_size]
+
+    def _arrays(self, rows):
+        states = self.reader['state'][rows]
+        next_states = self.reader['state'][rows + self.stride]
+        actions = self.reader['action'][rows].astype(np.int64)
+        # Rule-based policies log no action index: recover it from the order.
+        logged = actions >= 0
+        if not logged.all():
+            actions = np.where(logged, actions, order_to_action(self.reader['order'][rows], states[:, -1, 1]))
+        rewards = np.maximum(self.reader['reward'][rows], self.max_reward)
+        return states, actions, rewards, next_states
+
+    def sample_batch(self, batch_size):
+        """
+        -------------------------------------------------------
+        Returns a batch of transitions as stacked tensors.
+        -------------------------------------------------------
+        Preconditions: batch_size - the number of transitions.
+        Postconditions: Returns a Transition whose fields are tensors of
+            shape (batch_size, nstates, 5), (batch_size, 1),
+            (batch_size,) and (batch_size, nstates, 5).
+        -------------------------------------------------------
+        """
+        states, actions, rewards, next_states = self._arrays(self.sample_rows(batch_size))
+        return Transition(torch.tensor(states, device = device, dtype = torch.float32),
+                          torch.tensor(actions, device = device, dtype = torch.float32).view(-1, 1),
+                          torch.tensor(rewards, device = device, dtype = torch.float32),
+                          torch.tensor(next_states, device = device, dtype = torch.float32))
+
+    def sample(self, batch_size):
+        batch = self.sample_batch(batch_size)
+        return [Transition(s.unsqueeze(0), a.view(1, 1), r.view(1), ns.unsqueeze(0)) for s, a, r, ns in zip(*batch)]
+
+    def fill(self, memory, n_transitions = None):
+        """
+        -------------------------------------------------------
+        Pre-loads an online replay memory from the store.
+        -------------------------------------------------------
+        Preconditions: memory - a ReplayMemory.
+            n_transitions - the number of transitions to push, by
+                default enough to fill the memory.
+        Postconditions: memory holds randomly drawn recorded transitions,
+            in the same tensor format as the training loops push.
+        -------------------------------------------------------
+        """
+        if n_transitions is None:
+            n_transitions = memory.capacity
+        for transition in self.sample(min(n_transitions, self.n_transitions)):
+            memory.push(*transition)
+        return memory
+
+
+##############################################################################################
+
+
+def optimize_model(policy_net, target_net , optimizer , memory , batch_size = None , gamma = None):
+
+    batch_size = BATCH_SIZE if batch_size is None else batch_size
+    gamma = GAMMA if gamma is None else gamma
+
+    if len(memory) < batch_size:
+        return
+
+    if hasattr(memory, 'sample_batch'):
+        # Offline memories hand back the batch already stacked.
+        state_batch , action_batch , reward_batch , next_states = memory.sample_batch(batch_size)
+        non_final_mask = torch.ones(batch_size, device=device, dtype=torch.bool)
+        non_final_next_states = next_states
+    else:
+        transitions = memory.sample(batch_size)
+        # Transpose the batch
+        batch = Transition(*zip(*transitions))
+
+        # Compute a mask of non-final states and concatenate the batch elements
+        non_final_mask = torch.tensor(tuple(map(lambda s: s is not None, batch.next_state)), device=device, dtype=torch.bool)
+        non_final_next_states = torch.cat([s for s in batch.next_state if s is not None])
+
+        state_batch = torch.cat(batch.state)
+        action_batch = torch.cat(batch.action)
+        reward_batch = torch.cat(batch.reward)
+
+    # Compute Q(s_t, a) - the model computes Q(s_t), then we select the
+    # columns of actions taken
+    state_action_values = policy_net(state_batch).gather(1, action_batch.long())
+
+    # Compute V(s_{t+1}) for all next states.
+    next_state_values = torch.zeros(batch_size, device=device)
+    next_state_values[non_final_mask] = target_net(non_final_next_states).max(1)[0].detach()
+    # Compute the expected Q values
+    expected_state_action_values = (next_state_values * gamma) + reward_batch
+
+    # Compute Huber loss
+    loss = F.smooth_l1_loss(state_action_values, expected_state_action_values.unsqueeze(1))
+
+    # Optimize the model
+    optimizer.zero_grad()
+    loss.backward()
+    for param in policy_net.parameters():
+        param.grad.data.clamp_(-1, 1)
+    optimizer.step()
+
+
+def train_offline(policy, target_net , optimizer , memory , n_steps , target_update_steps = 3650 ,
+                  batch_size = None , gamma = None):
+    """
+    -------------------------------------------------------
+    Trains a DQN_Policy from a fixed dataset, without simulation.
+    -------------------------------------------------------
+    Preconditions: policy - the DQN_Policy to train.
+        memory - an OfflineMemory (or a pre-filled ReplayMemory).
+        n_steps - the number of optimization steps.
+        target_update_steps - steps between target network updates.
+            The default matches TARGET_UPDATE = 10 episodes of 365 weeks.
+    Postconditions: The policy network is trained in place and
+        policy.n_steps is advanced by n_steps.
+    -------------------------------------------------------
+    """
+    for step in range(n_steps):
+        optimize_model(policy.network , target_net , optimizer , memory , batch_size , gamma)
+        policy.n_steps += 1
+        if (step + 1) % target_update_steps == 0:
+            target_net.load_state_dict(policy.network.state_dict())
+
+    target_net.load_state_dict(policy.network.state_dict())
+    return policy
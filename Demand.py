@@ -0,0 +1,86 @@
+"""
+-------------------------------------------------------
+This file contains demand streams for the Customer class.
+-------------------------------------------------------
+Each function returns a generator yielding one order per
+week, so that a Customer built on it pulls demand lazily and
+a simulation can run for as long as the stream lasts.
+-------------------------------------------------------
+"""
+
+import csv
+import itertools
+import numpy as np
+
+
+def constant_demand(order = 10, weeks = None):
+    """
+    -------------------------------------------------------
+    Yields the same order every week.
+    -------------------------------------------------------
+    Preconditions: weeks - the stream length, None for endless.
+    Postconditions: Returns a generator of orders.
+    -------------------------------------------------------
+    """
+    weekly = itertools.repeat(order) if weeks is None else itertools.repeat(order, weeks)
+    for value in weekly:
+        yield value
+
+
+def periodic_demand(base = 20, amplitude = 10, period = 365, max_noise = 0, weeks = None, chunk_size = 4096, rng = None):
+    """
+    -------------------------------------------------------
+    Yields a seasonal demand with optional uniform noise.
+    -------------------------------------------------------
+    Preconditions: base, amplitude, period - the demand is
+            round(base + amplitude * sin(2 pi week / period)).
+        max_noise - noise drawn from rng.choice(max_noise) is added
+            when positive. rng defaults to the global np.random state.
+        weeks - the stream length, None for endless.
+        chunk_size - weeks generated per vectorized draw.
+    Postconditions: Returns a generator of orders.
+    -------------------------------------------------------
+    """
+    rng = np.random if rng is None else rng
+    counter = itertools.count(0, chunk_size) if weeks is None else range(0, weeks, chunk_size)
+    for start in counter:
+        stop = start + chunk_size if weeks is None else min(start + chunk_size, weeks)
+        week = np.arange(start, stop)
+        chunk = np.round(base + amplitude * np.sin(2 * np.pi * week / period))
+        if max_noise > 0:
+            chunk = chunk + rng.choice(max_noise, size = len(chunk))
+        for value in np.maximum(chunk, 0):
+            yield value
+
+
+def csv_demand(path, column = 'sales', store = 1, item = 1):
+    """
+    -------------------------------------------------------
+    Yields the sales of one store and item from a csv file, in
+    file order, reading it line by line.
+    -------------------------------------------------------
+    Preconditions: path - a csv file with store, item and column
+            fields, such as the train.csv sales file.
+    Postconditions: Returns a generator of orders. The file is never
+        loaded as a whole.
+    -------------------------------------------------------
+    """
+    with open(path, newline = '') as f:
+        for row in csv.DictReader(f):
+            if int(row['store']) == store and int(row['item']) == item:
+                yield float(row[column])
+
+
+def load_sales_demand(path, store = 1, item = 1, stop = None, column = 'sales'):
+    """
+    -------------------------------------------------------
+    Loads the sales of one store and item as a demand array.
+    -------------------------------------------------------
+    Preconditions: path - a csv file with store, item and column
+            fields, such as the train.csv sales file.
+        stop - the number of weeks kept, all of them if None.
+    Postconditions: Returns a numpy array usable as Customer orders.
+        The file is parsed with the csv module, without pandas.
+    -------------------------------------------------------
+    """
+    return np.fromiter(itertools.islice(csv_demand(path, column, store, item), stop), dtype = np.float64)
@@ -0,0 +1,328 @@
+"""
+-------------------------------------------------------
+This file contains the engine equivalence harness.
+-------------------------------------------------------
+Usage: python EngineEquivalence.py [--cases 50] [--seed 0]
+
+Plays random cases (demand traces, policies, queue delays,
+cost models and state layouts) on the reference object
+simulator (beer_game_Simulator) and on an alternate engine, and
+checks that every actor's demand, orders, stock, backorders,
+pipeline and cumulative cost agree week by week, as well as the
+final state windows. The throughput of both engines is reported
+alongside.
+
+An alternate engine is built as
+    engine(demand, initial_orders, initial_stock,
+           queue_delay_weeks, cost_model, nstates,
+           extended_state = ...)
+for a (games, weeks) demand array, and must provide
+init_simulation(*policies) and run_simulation(record = True)
+returning (costs, history) like BatchSimulator. Its final state
+windows are compared when it exposes them as states, of shape
+(4, games, nstates, state width).
+-------------------------------------------------------
+"""
+
+import argparse
+import sys
+import time
+
+import numpy as np
+
+from BeerGameSimulator import beer_game_Simulator, OrderPolicy
+from BatchSimulator import BatchSimulator
+from Players import Customer
+from SupplyChainActor import CostModel, N_ACTORS
+from TrajectoryStore import ACTORS
+
+
+QUANTITIES = ('demand', 'orders', 'stock', 'backorders', 'on_order', 'cost')
+
+
+class EquivalenceError(AssertionError):
+    pass
+
+
+def pad_rows(state, width):
+    # A row misses its in-transit entry when the queue is empty; the batch engine reads 0.
+    return [list(row) + [0] * (width - len(row)) for row in state]
+
+
+class LinearPolicy:
+
+    def __init__(self, weights, bias, low = -10, high = 60):
+        """
+        -------------------------------------------------------
+        Constructor for the LinearPolicy class, a deterministic test
+        policy ordering round(weights . last state row + bias),
+        clipped to [low, high] so that the chain cannot diverge.
+        -------------------------------------------------------
+        Preconditions: weights - 5 coefficients. bias, low, high - scalars.
+        Postconditions: Initializes the policy. Its orders can be
+            negative, which exercises the ignored negative envelopes.
+        -------------------------------------------------------
+        """
+        self.weights = np.asarray(weights, dtype = np.float64)
+        self.bias = bias
+        self.low = low
+        self.high = high
+        return
+
+    def calculate_order(self, state):
+        row = pad_rows(state[-1:], 5)[0][:5]
+        return float(np.clip(np.round(np.dot(self.weights, row) + self.bias), self.low, self.high)), None
+
+    def calculate_orders(self, states):
+        return np.clip(np.round(np.asarray(states)[:, -1, :5] @ self.weights + self.bias), self.low, self.high), None
+
+
+def random_demand(rng, games, weeks):
+    """
+    -------------------------------------------------------
+    Draws customer demand traces.
+    -------------------------------------------------------
+    Preconditions: rng - a numpy Generator.
+    Postconditions: Returns a (games, weeks) array mixing noisy
+        constant demand, step changes and random walks, with the odd
+        negative order.
+    -------------------------------------------------------
+    """
+    kind = rng.integers(3)
+    base = rng.integers(0, 20, (games, 1))
+    if kind == 0:
+        demand = base + rng.integers(0, 15, (games, weeks))
+    elif kind == 1:
+        demand = base + rng.integers(0, 20, (games, 1)) * (np.arange(weeks) >= rng.integers(1, weeks))
+    else:
+        demand = base + np.cumsum(rng.integers(-3, 4, (games, weeks)), axis = 1)
+    negative = rng.random((games, weeks)) < 0.02
+    return np.where(negative, -rng.integers(1, 5, (games, weeks)), demand).astype(np.float64)
+
+
+def random_policy(rng, delay, include_dqn = True, width = 5):
+    # A DQN state window is only rectangular when the in-transit queue is
+    # never empty, i.e. for delays of 2 weeks or more, or with extended
+    # states, whose rows are completed with 0.
+    kind = rng.integers(3 if include_dqn and (delay > 1 or width > 5) else 2)
+    if kind == 0:
+        return OrderPolicy(int(rng.integers(0, 60)))
+    if kind == 1:
+        return LinearPolicy(rng.normal(0, 0.5, 5), rng.normal(5, 5))
+    from DQN import DQN, DQN_Policy
+    return DQN_Policy(DQN(10, width))
+
+
+def random_case(rng, games = 4, include_dqn = True):
+    """
+    -------------------------------------------------------
+    Draws one random case.
+    -------------------------------------------------------
+    Preconditions: games - the number of demand traces of the case.
+        include_dqn - whether untrained DQN_Policy networks may be
+            drawn; they need torch.
+    Postconditions: Returns a dict with demand, policies,
+        initial_orders, initial_stock, queue_delay_weeks, cost_model
+        and extended_state.
+    -------------------------------------------------------
+    """
+    delay = int(rng.integers(1, 5))
+    weeks = int(rng.integers(20, 120))
+    exponents = (1, 1) if rng.random() < 0.7 else (1, 2)
+    extended = bool(rng.random() < 0.3)
+    return {'demand' : random_demand(rng, games, weeks) ,
+            'policies' : [random_policy(rng, delay, include_dqn, 7 if extended else 5) for _ in range(N_ACTORS)] ,
+            'initial_orders' : int(rng.integers(0, 10)) ,
+            'initial_stock' : int(rng.integers(0, 50)) ,
+            'queue_delay_weeks' : delay ,
+            'cost_model' : CostModel(rng.uniform(0, 2, N_ACTORS), rng.uniform(0, 3, N_ACTORS), *exponents,
+                                     lostSales = bool(rng.random() < 0.2)) ,
+            'extended_state' : extended}
+
+
+def run_reference(case):
+    """
+    -------------------------------------------------------
+    Plays a case on the object simulator, one game at a time.
+    -------------------------------------------------------
+    Preconditions: case - see random_case.
+    Postconditions: Returns (history, elapsed) : a dict of (games,
+        weeks, 4) arrays, one per name in QUANTITIES, plus the final
+        state windows as a (games, 4, nstates, state width) array
+        under state, and the seconds spent playing.
+    -------------------------------------------------------
+    """
+    demand = case['demand']
+    games, weeks = demand.shape
+    history = {name : np.empty((games, weeks, N_ACTORS)) for name in QUANTITIES}
+    extended = case.get('extended_state', False)
+    history['state'] = np.empty((games, N_ACTORS, 10, 7 if extended else 5))
+
+    elapsed = 0.
+    for game in range(games):
+        simulator = beer_game_Simulator(Customer(demand[game]), case['initial_orders'], case['initial_stock'],
+                                        case['queue_delay_weeks'], cost_model = case['cost_model'],
+                                        extended_state = extended)
+        simulator.init_simulation(*case['policies'])
+        actors = (simulator.myRetailer, simulator.myWholesaler, simulator.myDistributor, simulator.myFactory)
+
+        start = time.perf_counter()
+        for week in range(weeks):
+            res = simulator.step()
+            for k, (name, actor) in enumerate(zip(ACTORS, actors)):
+                values = (res[name]['state'][-1][3], actor.lastOrderQuantity, actor.currentStock, actor.currentOrders,
+                          actor.onOrder, actor.costsIncurred)
+                for quantity, value in zip(QUANTITIES, values):
+                    history[quantity][game, week, k] = value
+        elapsed += time.perf_counter() - start
+        for k, name in enumerate(ACTORS):
+            history['state'][game, k] = pad_rows(res[name]['state'], simulator.stateWidth)
+
+    return history, elapsed
+
+
+def run_engine(case, engine = BatchSimulator):
+    simulator = engine(case['demand'], case['initial_orders'], case['initial_stock'], case['queue_delay_weeks'],
+                       case['cost_model'], 10, extended_state = case.get('extended_state', False))
+    simulator.init_simulation(*case['policies'])
+    start = time.perf_counter()
+    _, history = simulator.run_simulation(record = True)
+    elapsed = time.perf_counter() - start
+    if hasattr(simulator, 'states'):
+        history = dict(history, state = np.moveaxis(simulator.states, 0, 1))
+    return history, elapsed
+
+
+def compare(reference, candidate, atol = 1e-9):
+    """
+    -------------------------------------------------------
+    Compares two recorded histories week by week.
+    -------------------------------------------------------
+    Preconditions: reference, candidate - dicts of (games, weeks, 4)
+        arrays holding at least the QUANTITIES, and optionally the
+        final state windows under state.
+    Postconditions: Returns None if they agree within atol, else a
+        description of the first (earliest week) mismatch. The state
+        windows are only checked once every week agrees.
+    -------------------------------------------------------
+    """
+    first = None
+    for quantity in QUANTITIES:
+        expected, got = reference[quantity], candidate[quantity]
+        if expected.shape != got.shape:
+            return '{0} : shape {1} instead of {2}'.format(quantity, got.shape, expected.shape)
+        wrong = np.argwhere(~np.isclose(got, expected, rtol = 1e-12, atol = atol) & ~(np.isnan(got) & np.isnan(expected)))
+        if len(wrong):
+            game, week, k = min(wrong, key = lambda index: (index[1], index[2], index[0]))
+            if first is None or (week, k) < first[0]:
+                first = ((week, k), '{0} of the {1}, game {2} week {3} : {4} instead of {5}'.format(
+                         quantity, ACTORS[k], game, week, got[game, week, k], expected[game, week, k]))
+    if first is not None:
+        return first[1]
+
+    if 'state' in reference and 'state' in candidate:
+        expected, got = reference['state'], candidate['state']
+        if expected.shape != got.shape:
+            return 'state : shape {0} instead of {1}'.format(got.shape, expected.shape)
+        wrong = np.argwhere(~np.isclose(got, expected, rtol = 1e-12, atol = atol))
+        if len(wrong):
+            game, k, row, column = wrong[0]
+            return 'final state of the {0}, game {1} row {2} entry {3} : {4} instead of {5}'.format(
+                   ACTORS[k], game, row, column, got[game, k, row, column], expected[game, k, row, column])
+    return None
+
+
+def run_harness(n_cases = 50, seed = 0, engine = BatchSimulator, games = 4, include_dqn = None, verbose = True):
+    """
+    -------------------------------------------------------
+    Checks an engine against the reference simulator on random cases.
+    -------------------------------------------------------
+    Preconditions: engine - the alternate engine, see the module
+            docstring.
+        games - demand traces per case, played as one batch.
+        include_dqn - whether to draw DQN_Policy networks, by default
+            whenever torch can be imported.
+    Postconditions: Returns a dict with the number of cases and the
+        weeks per second of both engines. Raises EquivalenceError on
+        the first case that differs, naming the case, quantity, actor,
+        game and week.
+    -------------------------------------------------------
+    """
+    if include_dqn is None:
+        try:
+            import torch
+            include_dqn = True
+        except ImportError:
+            include_dqn = False
+
+    rng = np.random.default_rng(seed)
+    weeks, reference_time, engine_time = 0, 0., 0.
+    for i in range(n_cases):
+        case = random_case(rng, games, include_dqn)
+        reference, elapsed = run_reference(case)
+        reference_time += elapsed
+        candidate, elapsed = run_engine(case, engine)
+        engine_time += elapsed
+        weeks += case['demand'].size
+
+        mismatch = compare(reference, candidate)
+        if mismatch is not None:
+            raise EquivalenceError('Case {0} (seed {1}, delay {2}, extended state {3}, policies {4}) : {5}'.format(
+                i, seed, case['queue_delay_weeks'], case['extended_state'], [type(p).__name__ for p in case['policies']],
+                mismatch))
+        if verbose:
+            sys.stderr.write('\r{0}/{1} cases equivalent'.format(i + 1, n_cases))
+    if verbose:
+        sys.stderr.write('\n')
+
+    return {'cases' : n_cases , 'weeks' : weeks ,
+            'reference_weeks_per_second' : weeks / reference_time ,
+            'engine_weeks_per_second' : weeks / engine_time}
+
+
+def throughput(engine = BatchSimulator, games = 1000, weeks = 365, seed = 0):
+    """
+    -------------------------------------------------------
+    Measures both engines on one large OrderPolicy batch.
+    -------------------------------------------------------
+    Preconditions: games, weeks - the size of the batch. The reference
+        plays a tenth of the games, at most 100.
+    Postconditions: Returns the weeks per second of both engines.
+    -------------------------------------------------------
+    """
+    rng = np.random.default_rng(seed)
+    case = {'demand' : 10 + rng.integers(0, 10, (games, weeks)).astype(np.float64) ,
+            'policies' : [OrderPolicy(30)] * N_ACTORS , 'initial_orders' : 5 , 'initial_stock' : 30 ,
+            'queue_delay_weeks' : 2 , 'cost_model' : None}
+    _, engine_time = run_engine(case, engine)
+
+    case['demand'] = case['demand'][:max(1, min(100, games // 10))]
+    _, reference_time = run_reference(case)
+    return {'reference_weeks_per_second' : case['demand'].size / reference_time ,
+            'engine_weeks_per_second' : games * weeks / engine_time}
+
+
+def main(argv = None):
+    parser = argparse.ArgumentParser(description = 'Check the batch engine against the reference simulator.')
+    parser.add_argument('--cases', type = int, default = 50)
+    parser.add_argument('--seed', type = int, default = 0)
+    parser.add_argument('--games', type = int, default = 4, help = 'demand traces per case')
+    parser.add_argument('--no-dqn', action = 'store_true', help = 'only draw rule-based policies')
+    args = parser.parse_args(argv)
+
+    try:
+        results = run_harness(args.cases, args.seed, games = args.games, include_dqn = False if args.no_dqn else None)
+    except EquivalenceError as error:
+        print('NOT EQUIVALENT : {0}'.format(error))
+        return 1
+    print('{0} cases, {1} game-weeks : equivalent'.format(results['cases'], results['weeks']))
+
+    speed = throughput()
+    print('Reference : {0:.0f} weeks/s - BatchSimulator : {1:.0f} weeks/s ({2:.0f}x)'.format(
+          speed['reference_weeks_per_second'], speed['engine_weeks_per_second'],
+          speed['engine_weeks_per_second'] / speed['reference_weeks_per_second']))
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,162 @@
+"""
+-------------------------------------------------------
+This file contains the population (league) evaluator.
+-------------------------------------------------------
+Every role (retailer, wholesaler, distributor, factory) has a
+population of candidate policies. An assignment picks one
+candidate per role; all assignments, or a random subset, are
+played as BatchSimulator games against the same demand traces.
+The games of a chunk share one batch : each role's decisions
+are made by a PolicyGroup, which hands every candidate the rows
+it plays in, so each network runs one forward pass per week
+and is never copied. Chunks bound the memory to max_games
+games whatever the number of assignments.
+-------------------------------------------------------
+"""
+
+import numpy as np
+
+from BatchSimulator import BatchSimulator, batch_orders
+from SupplyChainActor import N_ACTORS
+from TrajectoryStore import ACTORS
+
+
+class PolicyGroup:
+
+    def __init__(self, policies, index):
+        """
+        -------------------------------------------------------
+        Constructor for the PolicyGroup class, a batch policy whose
+        rows are played by different candidates.
+        -------------------------------------------------------
+        Preconditions: policies - the candidate policies of a role.
+            index - a (batch,) array : the candidate playing each row.
+        Postconditions:
+            Initializes the group. The policies are referenced, not
+            copied.
+        -------------------------------------------------------
+        """
+        self.policies = policies
+        self.index = np.asarray(index)
+        self.rows = [(i, np.flatnonzero(self.index == i)) for i in np.unique(self.index)]
+        return
+
+    def calculate_orders(self, states):
+        orders = np.empty(len(states))
+        actions = np.full(len(states), -1)
+        for i, rows in self.rows:
+            orders[rows], actions[rows] = batch_orders(self.policies[i], states[rows])
+        return orders, actions
+
+
+def assignments(sizes, n_assignments = None, rng = None):
+    """
+    -------------------------------------------------------
+    Lists the role assignments to play.
+    -------------------------------------------------------
+    Preconditions: sizes - the population size of each role.
+        n_assignments - the number of assignments drawn uniformly
+            without replacement, all of them if None.
+        rng - the numpy Generator drawing them.
+    Postconditions: Returns an (n, 4) array of candidate indices, in
+        lexicographic order.
+    -------------------------------------------------------
+    """
+    total = int(np.prod(sizes))
+    if n_assignments is None or n_assignments >= total:
+        flat = np.arange(total)
+    else:
+        rng = np.random.default_rng() if rng is None else rng
+        flat = np.sort(rng.choice(total, n_assignments, replace = False))
+    return np.stack(np.unravel_index(flat, sizes), axis = 1)
+
+
+def evaluate_league(populations, demand, initial_orders = 5, initial_stock = 30, queue_delay_weeks = 2, cost_model = None,
+                    n_assignments = None, max_games = 4096, rng = None, verbose = False):
+    """
+    -------------------------------------------------------
+    Evaluates every (or a sample of) role assignment.
+    -------------------------------------------------------
+    Preconditions: populations - four lists of policies, retailer to
+            factory. A list may be shared between roles, e.g.
+            [candidates] * 4, or hold a single policy, e.g. [opolicy].
+        demand - a (traces, weeks) array : every assignment plays
+            every trace, so that assignments are compared on the same
+            demand.
+        initial_orders, initial_stock, queue_delay_weeks, cost_model -
+            as for BatchSimulator.
+        n_assignments, rng - see assignments().
+        max_games - the largest number of games simulated at once;
+            assignments are played in chunks of max_games // traces.
+    Postconditions: Returns a dict with
+            assignments - the (n, 4) candidate indices played.
+            costs - the (n, 4) mean cost of each role per assignment.
+            total - the (n,) mean chain cost.
+            matrix - the chain cost indexed by the candidate of each
+                role, of shape (P_retailer, P_wholesaler, P_distributor,
+                P_factory) and NaN where an assignment was not played.
+                It is only built when all the assignments are played.
+    -------------------------------------------------------
+    """
+    if cost_model is not None and cost_model.gridShape != ():
+        raise ValueError('A league ranks candidates under a single cost structure, not a grid of {0}'.format(
+                         cost_model.gridShape))
+    demand = np.atleast_2d(np.asarray(demand, dtype = np.float64))
+    n_traces = len(demand)
+    sizes = tuple(len(population) for population in populations)
+    played = assignments(sizes, n_assignments, rng)
+
+    chunk = max(1, max_games // n_traces)
+    costs = np.empty((len(played), N_ACTORS))
+    for start in range(0, len(played), chunk):
+        block = played[start:start + chunk]
+        # Row r plays assignment r // n_traces on trace r % n_traces.
+        simulator = BatchSimulator(np.tile(demand, (len(block), 1)), initial_orders, initial_stock, queue_delay_weeks,
+                                   cost_model)
+        simulator.init_simulation(*[PolicyGroup(populations[k], np.repeat(block[:, k], n_traces)) for k in range(N_ACTORS)])
+        run_costs = simulator.run_simulation()
+        costs[start:start + len(block)] = run_costs.reshape(len(block), n_traces, N_ACTORS).mean(axis = 1)
+        if verbose:
+            print('{0}/{1} assignments played'.format(start + len(block), len(played)))
+
+    results = {'assignments' : played , 'costs' : costs , 'total' : costs.sum(axis = 1) , 'matrix' : None}
+    if len(played) == np.prod(sizes):
+        results['matrix'] = results['total'].reshape(sizes)
+    return results
+
+
+def rank_pairings(results, roles = (0, 1), worst_case = False):
+    """
+    -------------------------------------------------------
+    Ranks the candidate combinations of some roles by how well they
+    do whatever the other roles play.
+    -------------------------------------------------------
+    Preconditions: results - returned by evaluate_league.
+        roles - the role indices forming a pairing, retailer and
+            wholesaler by default.
+        worst_case - rank on the worst chain cost over the other roles
+            instead of the mean.
+    Postconditions: Returns a list of (candidate indices, mean cost,
+        worst cost, number of assignments), best first.
+    -------------------------------------------------------
+    """
+    keys = results['assignments'][:, list(roles)]
+    unique, inverse = np.unique(keys, axis = 0, return_inverse = True)
+    inverse = inverse.reshape(-1)
+    total = results['total']
+
+    counts = np.bincount(inverse)
+    mean = np.bincount(inverse, weights = total) / counts
+    worst = np.full(len(unique), -np.inf)
+    np.maximum.at(worst, inverse, total)
+
+    order = np.argsort(worst if worst_case else mean)
+    return [(tuple(int(i) for i in unique[j]), float(mean[j]), float(worst[j]), int(counts[j])) for j in order]
+
+
+def describe(results, top = 5, roles = (0, 1)):
+    # Prints the best pairings of rank_pairings.
+    names = ' / '.join(ACTORS[k] for k in roles)
+    print('Best {0} pairings (mean cost, worst cost, assignments) :'.format(names))
+    for candidates, mean, worst, count in rank_pairings(results, roles)[:top]:
+        print('  {0} : {1:.1f} , {2:.1f} , {3}'.format(candidates, mean, worst, count))
@@ -17,7 +17,9 @@ import numpy as np
 
 class Retailer(SupplyChainActor):
     
-    def __init__(self, policy, nstates , initial_stock , incomingOrdersQueue, outgoingOrdersQueue, incomingDeliveriesQueue, outgoingDeliveriesQueue, theCustomer):
+    ACTOR_INDEX = 0
+    
+    def __init__(self, policy, nstates , initial_stock , incomingOrdersQueue, outgoingOrdersQueue, incomingDeliveriesQueue, outgoingDeliveriesQueue, theCustomer, costModel = None, extendedState = False):
         """
         -------------------------------------------------------
         Constructor for the Retailer class.
@@ -32,7 +34,7 @@ class Retailer(SupplyChainActor):
             retailer's customer.
         -------------------------------------------------------
         """
-        super().__init__(policy , nstates, initial_stock , incomingOrdersQueue, outgoingOrdersQueue, incomingDeliveriesQueue, outgoingDeliveriesQueue)
+        super().__init__(policy , nstates, initial_stock , incomingOrdersQueue, outgoingOrdersQueue, incomingDeliveriesQueue, outgoingDeliveriesQueue, costModel, extendedState)
         self.customer = theCustomer
 
 
@@ -90,9 +92,10 @@ class Retailer(SupplyChainActor):
         curr_state = [old_stock , new_shipment , old_orders , new_orders]
         # Incoming Deliveries
         curr_state.extend(self.outgoingOrdersQueue.data[:1])
+        curr_state = self.ExtendState(curr_state)
         self.states.append(curr_state) 
-        state = self.states[-self.nstates:]
-        if len(state) < self.nstates : state = [[-1 , -1 , -1 , -1 , -1]]*(self.nstates - len(state)) + state
+        state = list(self.states)
+        if len(state) < self.nstates : state = [[-1]*self.stateWidth]*(self.nstates - len(state)) + state
         # --------------------------------------------
         ##############################################
 
@@ -120,12 +123,13 @@ class Retailer(SupplyChainActor):
 
 class Customer:
 
-    def __init__(self , orders , max_noise = 0):
+    def __init__(self , orders , max_noise = 0, rng = None):
         """
         -------------------------------------------------------
         Constructor for the Customer class.
         -------------------------------------------------------
-        Preconditions: None
+        Preconditions: rng - the numpy Generator drawing the demand
+                noise. Defaults to the global np.random state.
         Postconditions:
             Initializes the Customer object in its initial state.
         -------------------------------------------------------
@@ -133,6 +137,37 @@ class Customer:
         self.totalBeerReceived = 0
         self.orders = orders
         self.max_noise = max_noise
+        self.rng = np.random if rng is None else rng
+
+        #Demand given as an iterator/generator is pulled one week at a time.
+        self.stream = None if hasattr(orders, '__getitem__') else iter(orders)
+        self.pendingOrder = None
+        self.streamStarted = False
+        return
+    
+    def Restart(self):
+        """
+        -------------------------------------------------------
+        Prepares the customer's demand for a new game.
+        -------------------------------------------------------
+        Preconditions: None.
+        Postconditions:
+            A streamed demand is restarted from its first week when
+            orders is a re-iterable (e.g. a list of weeks read lazily
+            or an object with __iter__). A one-shot iterator or
+            generator cannot be replayed : reusing it once it was read
+            raises ValueError instead of silently continuing it.
+        -------------------------------------------------------
+        """
+        if self.stream is None or not self.streamStarted:
+            return
+        stream = iter(self.orders)
+        if stream is self.orders:
+            raise ValueError("The customer's demand stream was already played and cannot be restarted : "
+                             "build a new Customer from a fresh generator")
+        self.stream = stream
+        self.pendingOrder = None
+        self.streamStarted = False
         return
     
     def RecieveFromRetailer(self, amountReceived):
@@ -150,6 +185,25 @@ class Customer:
         
         return
     
+    def HasOrder(self, weekNum):
+        """
+        -------------------------------------------------------
+        Tells whether the customer has an order for a given week.
+        -------------------------------------------------------
+        Preconditions: weekNum - the current week of game-play.
+        Postconditions:
+            Returns False once the demand array or stream is exhausted.
+            For streams, the next order is fetched and kept until
+            CalculateOrder consumes it.
+        -------------------------------------------------------
+        """
+        if self.stream is None:
+            return weekNum < len(self.orders)
+        if self.pendingOrder is None:
+            self.streamStarted = True
+            self.pendingOrder = next(self.stream, None)
+        return self.pendingOrder is not None
+    
     def CalculateOrder(self, weekNum):
         """
         -------------------------------------------------------
@@ -161,7 +215,13 @@ class Customer:
             for all other weeks. 
         -------------------------------------------------------
         """
-        cnorder = self.orders[weekNum] + np.random.choice(self.max_noise) if self.max_noise > 0 else self.orders[weekNum]
+        if self.stream is not None:
+            if not self.HasOrder(weekNum):
+                raise IndexError("Customer demand stream exhausted at week {0}".format(weekNum))
+            order, self.pendingOrder = self.pendingOrder, None
+        else:
+            order = self.orders[weekNum]
+        cnorder = order + self.rng.choice(self.max_noise) if self.max_noise > 0 else order
         return cnorder
     
     def GetBeerReceived(self):
@@ -189,7 +249,9 @@ class Customer:
 
 class Wholesaler(SupplyChainActor):
     
-    def __init__(self, policy, nstates , initial_stock , incomingOrdersQueue, outgoingOrdersQueue, incomingDeliveriesQueue, outgoingDeliveriesQueue):
+    ACTOR_INDEX = 1
+    
+    def __init__(self, policy, nstates , initial_stock , incomingOrdersQueue, outgoingOrdersQueue, incomingDeliveriesQueue, outgoingDeliveriesQueue, costModel = None, extendedState = False):
         """
         -------------------------------------------------------
         Constructor for the Wholesaler class.
@@ -201,7 +263,7 @@ class Wholesaler(SupplyChainActor):
             by calling parent constructor.
         -------------------------------------------------------
         """
-        super().__init__(policy , nstates, initial_stock , incomingOrdersQueue, outgoingOrdersQueue, incomingDeliveriesQueue, outgoingDeliveriesQueue)
+        super().__init__(policy , nstates, initial_stock , incomingOrdersQueue, outgoingOrdersQueue, incomingDeliveriesQueue, outgoingDeliveriesQueue, costModel, extendedState)
         return
     
     def TakeTurn(self, weekNum):
@@ -225,9 +287,10 @@ class Wholesaler(SupplyChainActor):
         curr_state = [old_stock , new_shipment , old_orders , new_orders]
         # Incoming Deliveries
         curr_state.extend(self.outgoingOrdersQueue.data[:1])
+        curr_state = self.ExtendState(curr_state)
         self.states.append(curr_state) 
-        state = self.states[-self.nstates:]
-        if len(state) < self.nstates : state = [[-1 , -1 , -1 , -1 , -1]]*(self.nstates - len(state)) + state
+        state = list(self.states)
+        if len(state) < self.nstates : state = [[-1]*self.stateWidth]*(self.nstates - len(state)) + state
         # --------------------------------------------
         ##############################################
 
@@ -258,7 +321,9 @@ class Wholesaler(SupplyChainActor):
 
 class Distributor(SupplyChainActor):
     
-    def __init__(self, policy, nstates , initial_stock , incomingOrdersQueue, outgoingOrdersQueue, incomingDeliveriesQueue, outgoingDeliveriesQueue):
+    ACTOR_INDEX = 2
+    
+    def __init__(self, policy, nstates , initial_stock , incomingOrdersQueue, outgoingOrdersQueue, incomingDeliveriesQueue, outgoingDeliveriesQueue, costModel = None, extendedState = False):
         """
         -------------------------------------------------------
         Constructor for the Distributor class.
@@ -270,7 +335,7 @@ class Distributor(SupplyChainActor):
             by calling parent constructor.
         -------------------------------------------------------
         """
-        super().__init__(policy , nstates, initial_stock , incomingOrdersQueue, outgoingOrdersQueue, incomingDeliveriesQueue, outgoingDeliveriesQueue)
+        super().__init__(policy , nstates, initial_stock , incomingOrdersQueue, outgoingOrdersQueue, incomingDeliveriesQueue, outgoingDeliveriesQueue, costModel, extendedState)
         return
     
     
@@ -294,9 +359,10 @@ class Distributor(SupplyChainActor):
         curr_state = [old_stock , new_shipment , old_orders , new_orders]
         # Incoming Deliveries
         curr_state.extend(self.outgoingOrdersQueue.data[:1])
+        curr_state = self.ExtendState(curr_state)
         self.states.append(curr_state) 
-        state = self.states[-self.nstates:]
-        if len(state) < self.nstates : state = [[-1 , -1 , -1 , -1 , -1]]*(self.nstates - len(state)) + state
+        state = list(self.states)
+        if len(state) < self.nstates : state = [[-1]*self.stateWidth]*(self.nstates - len(state)) + state
         # --------------------------------------------
         ##############################################
 
@@ -327,7 +393,9 @@ class Distributor(SupplyChainActor):
 
 class Factory(SupplyChainActor):
     
-    def __init__(self, policy, nstates , initial_stock , incomingOrdersQueue, outgoingOrdersQueue, incomingDeliveriesQueue, outgoingDeliveriesQueue, factoryProductionDelayQueue):
+    ACTOR_INDEX = 3
+    
+    def __init__(self, policy, nstates , initial_stock , incomingOrdersQueue, outgoingOrdersQueue, incomingDeliveriesQueue, outgoingDeliveriesQueue, factoryProductionDelayQueue, costModel = None, extendedState = False):
         """
         -------------------------------------------------------
         Constructor for the Factory class.
@@ -341,8 +409,10 @@ class Factory(SupplyChainActor):
             retailer's customer.
         -------------------------------------------------------
         """
-        super().__init__(policy , nstates, initial_stock , incomingOrdersQueue, outgoingOrdersQueue, incomingDeliveriesQueue, outgoingDeliveriesQueue)
+        super().__init__(policy , nstates, initial_stock , incomingOrdersQueue, outgoingOrdersQueue, incomingDeliveriesQueue, outgoingDeliveriesQueue, costModel, extendedState)
         self.BeerProductionDelayQueue = factoryProductionDelayQueue
+        #The factory's pipeline is its production queue.
+        self.onOrder = self.InTransit(factoryProductionDelayQueue)
         
         return
     
@@ -359,7 +429,8 @@ class Factory(SupplyChainActor):
         """
             
         amountToOrder , policy_action  = self.policy.calculate_order( state )
-        self.BeerProductionDelayQueue.PushEnvelope(amountToOrder)
+        if self.BeerProductionDelayQueue.PushEnvelope(amountToOrder):
+            self.RecordOrderPlaced(amountToOrder)
         self.lastOrderQuantity = amountToOrder
         
         return policy_action
@@ -379,6 +450,7 @@ class Factory(SupplyChainActor):
         
         if amountProduced > 0:
             self.currentStock += amountProduced
+            self.RecordDeliveryReceived(amountProduced)
         
         return amountProduced
      
@@ -402,9 +474,10 @@ class Factory(SupplyChainActor):
         curr_state = [old_stock , new_shipment , old_orders , new_orders]
         # Incoming Deliveries
         curr_state.extend(self.BeerProductionDelayQueue.data[:1])
+        curr_state = self.ExtendState(curr_state)
         self.states.append(curr_state)
-        state = self.states[-self.nstates:]
-        if len(state) < self.nstates : state = [[-1 , -1 , -1 , -1 , -1]]*(self.nstates - len(state)) + state
+        state = list(self.states)
+        if len(state) < self.nstates : state = [[-1]*self.stateWidth]*(self.nstates - len(state)) + state
         # --------------------------------------------
         ##############################################
 
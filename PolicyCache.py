@@ -0,0 +1,237 @@
+"""
+-------------------------------------------------------
+This file contains and defines the CachedPolicy class.
+-------------------------------------------------------
+A CachedPolicy sits in front of any policy exposing
+calculate_order(state) and memoizes its decisions, keyed
+on the (nstates, 5) state window.
+
+With a quantum, neighbouring windows share a cache entry. For
+policies with an action index and an order_from_action method
+(DQN_Policy), only the action is shared and the order is
+recomputed from the current window. Rule-based policies have
+no action, so the cached order itself is shared : quantization
+then changes the orders placed, not just the cost of deciding.
+-------------------------------------------------------
+"""
+
+from collections import OrderedDict
+import numpy as np
+
+
+class CachedPolicy:
+
+    def __init__(self, policy, maxsize = 4096, quantum = None):
+        """
+        -------------------------------------------------------
+        Constructor for the CachedPolicy class.
+        -------------------------------------------------------
+        Preconditions: policy - any object with a calculate_order(state)
+                method returning (amountToOrder, policy_action).
+            maxsize - the maximum number of state windows kept (LRU).
+            quantum - if given, state values are rounded to multiples
+                of quantum before hashing, so that neighbouring windows
+                share a decision (see the module description). None
+                keys on the exact values.
+        Postconditions:
+            Initializes an empty cache in front of policy.
+        -------------------------------------------------------
+        """
+        self.policy = policy
+        self.maxsize = maxsize
+        self.quantum = quantum
+
+        self.hits = 0
+        self.misses = 0
+        self.invalidations = 0
+
+        self._cache = OrderedDict()
+        self._weights_version = self._network_version()
+        return
+
+    # The wrapped policy is still toggled through .train by update_costs and
+    # the training loops, so the attribute is forwarded rather than copied.
+    @property
+    def train(self):
+        return getattr(self.policy, 'train', False)
+
+    @train.setter
+    def train(self, value):
+        self.policy.train = value
+
+    def __getattr__(self, name):
+        # Only called when normal lookup fails (network, n_steps, ...).
+        # calculate_orders is defined below, so batched callers go through the cache too.
+        if name == 'policy':
+            raise AttributeError(name)
+        return getattr(self.policy, name)
+
+    def _network_version(self):
+        """
+        -------------------------------------------------------
+        Returns a fingerprint of the wrapped network's weights.
+        -------------------------------------------------------
+        Preconditions: None.
+        Postconditions: Returns None for policies without a network.
+            Otherwise returns the network identity together with the
+            in-place version counter of every parameter, which torch
+            bumps on optimizer.step() and load_state_dict().
+        -------------------------------------------------------
+        """
+        network = getattr(self.policy, 'network', None)
+        if network is None:
+            return None
+        return (id(network),) + tuple(p._version for p in network.parameters())
+
+    @staticmethod
+    def _window(state):
+        # Rows built while the in-transit queue was empty are one entry short : key them with a 0 there.
+        if isinstance(state, np.ndarray):
+            return state.astype(np.float64, copy = False)
+        width = max(len(row) for row in state)
+        return np.array([list(row) + [0] * (width - len(row)) for row in state], dtype = np.float64)
+
+    def _key(self, window):
+        if self.quantum:
+            window = np.round(window / self.quantum)
+        return window.shape, window.tobytes()
+
+    def _shared_order(self, windows, orders, actions):
+        # Under a quantum, a hit may come from another window : an action-based
+        # policy's order is rebuilt from the current window.
+        if not self.quantum or actions is None or not hasattr(self.policy, 'order_from_action'):
+            return orders
+        return self.policy.order_from_action(windows, actions)
+
+    def invalidate(self):
+        """
+        -------------------------------------------------------
+        Empties the cache.
+        -------------------------------------------------------
+        Preconditions: None.
+        Postconditions: All memoized decisions are dropped. The hit
+            and miss counters are kept.
+        -------------------------------------------------------
+        """
+        self._cache.clear()
+        self.invalidations += 1
+        return
+
+    def calculate_order(self, state):
+        """
+        -------------------------------------------------------
+        Returns the wrapped policy's decision for state, from the
+        cache when possible.
+        -------------------------------------------------------
+        Preconditions: state - the (nstates, 5) state window. Rows
+            missing their in-transit entry are read as 0.
+        Postconditions: Returns (amountToOrder, policy_action). A policy
+            in training mode explores at random, so it is never cached.
+            The cache is flushed whenever the network weights changed
+            since the last call.
+        -------------------------------------------------------
+        """
+        if self.train:
+            return self.policy.calculate_order(state)
+
+        self._check_weights()
+
+        window = self._window(state)
+        key = self._key(window)
+        decision = self._cache.get(key)
+        if decision is not None:
+            self._cache.move_to_end(key)
+            self.hits += 1
+            order, action = decision
+            return (order if action is None else self._shared_order(window, order, action)), action
+
+        self.misses += 1
+        decision = self.policy.calculate_order(state)
+        self._cache[key] = decision
+        if len(self._cache) > self.maxsize:
+            self._cache.popitem(last = False)
+
+        return decision
+
+    def calculate_orders(self, states):
+        """
+        -------------------------------------------------------
+        Batched calculate_order, from the cache when possible.
+        -------------------------------------------------------
+        Preconditions: states - a (batch, nstates, 5) array.
+        Postconditions: Returns (orders, actions) arrays, actions being
+            None for rule-based policies. Every row is looked up; the
+            distinct missing windows are sent to the wrapped policy in
+            a single call and cached.
+        -------------------------------------------------------
+        """
+        states = np.asarray(states, dtype = np.float64)
+        if self.train:
+            return self._policy_orders(states)
+
+        self._check_weights()
+
+        decisions = [None] * len(states)
+        missing = OrderedDict()
+        for i, state in enumerate(states):
+            key = self._key(state)
+            decision = self._cache.get(key)
+            if decision is None:
+                # Repeats of a window missing earlier in the batch are hits.
+                if key in missing:
+                    self.hits += 1
+                else:
+                    self.misses += 1
+                missing.setdefault(key, []).append(i)
+            else:
+                self._cache.move_to_end(key)
+                self.hits += 1
+                decisions[i] = decision
+
+        if missing:
+            rows = [indices[0] for indices in missing.values()]
+            orders, actions = self._policy_orders(states[rows])
+            for j, (key, indices) in enumerate(missing.items()):
+                decision = (orders[j], None if actions is None else int(actions[j]))
+                self._cache[key] = decision
+                for i in indices:
+                    decisions[i] = decision
+            while len(self._cache) > self.maxsize:
+                self._cache.popitem(last = False)
+
+        orders = np.array([order for order, _ in decisions], dtype = np.float64)
+        if all(action is None for _, action in decisions):
+            return orders, None
+        actions = np.array([-1 if action is None else action for _, action in decisions])
+        return self._shared_order(states, orders, actions), actions
+
+    def _policy_orders(self, states):
+        if hasattr(self.policy, 'calculate_orders'):
+            return self.policy.calculate_orders(states)
+        decisions = [self.policy.calculate_order(state.tolist()) for state in states]
+        actions = [action for _, action in decisions]
+        return (np.array([order for order, _ in decisions], dtype = np.float64),
+                None if all(action is None for action in actions) else np.array([-1 if a is None else a for a in actions]))
+
+    def _check_weights(self):
+        # Flushes the cache whenever the network weights changed since the last call.
+        version = self._network_version()
+        if version != self._weights_version:
+            self.invalidate()
+            self._weights_version = version
+
+    def hit_rate(self):
+        """
+        -------------------------------------------------------
+        Returns the fraction of cached lookups that were hits.
+        -------------------------------------------------------
+        Preconditions: None.
+        Postconditions: Returns 0 if no lookup was made yet.
+        -------------------------------------------------------
+        """
+        lookups = self.hits + self.misses
+        return self.hits / lookups if lookups > 0 else 0.
+
+    def cache_info(self):
+        return {'hits' : self.hits , 'misses' : self.misses , 'hit_rate' : self.hit_rate() ,
+                'size' : len(self._cache) , 'maxsize' : self.maxsize , 'invalidations' : self.invalidations}
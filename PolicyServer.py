@@ -0,0 +1,406 @@
+"""
+-------------------------------------------------------
+This file contains and defines the local policy server.
+-------------------------------------------------------
+Usage: python PolicyServer.py serve POLICY [--port 8000]
+           [--max-batch 256] [--max-delay-ms 2] [--state-width 5]
+       python PolicyServer.py bench [--port 8000]
+           [--requests 10000] [--concurrency 64] [--state-width 5]
+
+POLICY is a DQN checkpoint (.pt state_dict) or a BatchRunner
+policy spec (.json), e.g. {"type": "order", "target_stock": 30}.
+
+Endpoints, JSON over plain HTTP/1.1 on localhost:
+    POST /order  {"state": [[...state_width values...] x nstates]}
+                 -> {"order": 12.0, "action": 17}
+    GET  /stats  -> latency p50/p99, throughput, batch sizes.
+Concurrent requests are coalesced by a MicroBatcher into one
+calculate_orders call, waiting at most max_delay for the
+batch to fill.
+-------------------------------------------------------
+"""
+
+import argparse
+import asyncio
+from collections import deque
+import json
+import time
+
+import numpy as np
+
+
+class LatencyStats:
+
+    def __init__(self, window = 100000):
+        """
+        -------------------------------------------------------
+        Constructor for the LatencyStats class.
+        -------------------------------------------------------
+        Preconditions: window - the number of most recent request
+                latencies the percentiles are computed over.
+        Postconditions:
+            Initializes the counters; the uptime clock starts now.
+        -------------------------------------------------------
+        """
+        self.latencies = deque(maxlen = window)
+        self.batch_sizes = deque(maxlen = window)
+        self.n_requests = 0
+        self.n_batches = 0
+        self.start = time.perf_counter()
+        # Arrival of the first request and completion of the last one.
+        self.first_request = None
+        self.last_request = None
+        return
+
+    def record_request(self, latency):
+        now = time.perf_counter()
+        self.latencies.append(latency)
+        self.n_requests += 1
+        if self.first_request is None:
+            self.first_request = now - latency
+        self.last_request = now
+
+    def record_batch(self, size):
+        self.batch_sizes.append(size)
+        self.n_batches += 1
+
+    def summary(self):
+        """
+        -------------------------------------------------------
+        Returns the serving figures so far.
+        -------------------------------------------------------
+        Preconditions: None.
+        Postconditions: Returns a dict with the request count, the
+            p50/p99/max latency in milliseconds, the throughput in
+            requests per second and the mean batch size. The
+            throughput is measured from the arrival of the first
+            request to the completion of the last one, so that idle
+            time before and after does not deflate it.
+        -------------------------------------------------------
+        """
+        elapsed = time.perf_counter() - self.start
+        active = 0. if self.first_request is None else self.last_request - self.first_request
+        latencies = np.asarray(self.latencies) * 1000
+        p50, p99, worst = np.percentile(latencies, [50, 99, 100]) if len(latencies) else (0., 0., 0.)
+        return {'requests' : self.n_requests , 'batches' : self.n_batches ,
+                'p50_ms' : float(p50) , 'p99_ms' : float(p99) , 'max_ms' : float(worst) ,
+                'throughput' : self.n_requests / active if active > 0 else 0. , 'active_s' : active ,
+                'mean_batch' : float(np.mean(self.batch_sizes)) if self.batch_sizes else 0. ,
+                'uptime_s' : elapsed}
+
+
+##############################################################################################
+
+
+class MicroBatcher:
+
+    def __init__(self, policy, max_batch = 256, max_delay = 0.002, stats = None):
+        """
+        -------------------------------------------------------
+        Constructor for the MicroBatcher class.
+        -------------------------------------------------------
+        Preconditions: policy - an object with a calculate_orders(states)
+                method, such as OrderPolicy or DQN_Policy.
+            max_batch - the largest number of states per call.
+            max_delay - the latency budget in seconds: a batch is
+                dispatched at most max_delay after its first request.
+            stats - a LatencyStats, a new one by default.
+        Postconditions:
+            Initializes the request queue. start() must be awaited
+            from the serving event loop.
+        -------------------------------------------------------
+        """
+        self.policy = policy
+        self.max_batch = max_batch
+        self.max_delay = max_delay
+        self.stats = LatencyStats() if stats is None else stats
+        self.queue = None
+        self.task = None
+        return
+
+    async def start(self):
+        self.queue = asyncio.Queue()
+        self.task = asyncio.ensure_future(self._run())
+
+    async def stop(self):
+        self.task.cancel()
+        try:
+            await self.task
+        except asyncio.CancelledError:
+            pass
+
+    async def submit(self, state):
+        """
+        -------------------------------------------------------
+        Queues one state window and waits for its decision.
+        -------------------------------------------------------
+        Preconditions: state - an (nstates, state_width) array.
+        Postconditions: Returns (order, action); action is None for
+            rule-based policies.
+        -------------------------------------------------------
+        """
+        future = asyncio.get_running_loop().create_future()
+        await self.queue.put((state, future, time.perf_counter()))
+        return await future
+
+    async def _collect(self):
+        # Blocks for the first request, then drains the queue until the
+        # batch is full or the latency budget of that request is spent.
+        batch = [await self.queue.get()]
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + self.max_delay
+        while len(batch) < self.max_batch:
+            if not self.queue.empty():
+                batch.append(self.queue.get_nowait())
+                continue
+            timeout = deadline - loop.time()
+            if timeout <= 0:
+                break
+            try:
+                batch.append(await asyncio.wait_for(self.queue.get(), timeout))
+            except asyncio.TimeoutError:
+                break
+        return batch
+
+    async def _run(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            batch = await self._collect()
+            states = np.stack([state for state, _, _ in batch])
+            try:
+                # The forward pass runs off the loop so that the next batch
+                # keeps filling meanwhile.
+                orders, actions = await loop.run_in_executor(None, self.policy.calculate_orders, states)
+            except Exception as error:
+                for _, future, _ in batch:
+                    if not future.done(): future.set_exception(error)
+                continue
+
+            self.stats.record_batch(len(batch))
+            now = time.perf_counter()
+            for i, (_, future, submitted) in enumerate(batch):
+                if future.done():
+                    continue
+                future.set_result((float(orders[i]), None if actions is None else int(actions[i])))
+                self.stats.record_request(now - submitted)
+
+
+##############################################################################################
+
+
+REASONS = {200 : 'OK', 400 : 'Bad Request', 404 : 'Not Found', 500 : 'Internal Server Error'}
+
+
+class PolicyServer:
+
+    def __init__(self, policy, nstates = 10, max_batch = 256, max_delay = 0.002, state_width = 5):
+        """
+        -------------------------------------------------------
+        Constructor for the PolicyServer class.
+        -------------------------------------------------------
+        Preconditions: policy - see MicroBatcher.
+            nstates - the number of weeks in a state window.
+            max_batch, max_delay - see MicroBatcher.
+            state_width - the number of entries of a state row, 7 for
+                a policy trained on extended states.
+        Postconditions:
+            Initializes the batcher. Nothing listens until serve().
+        -------------------------------------------------------
+        """
+        self.nstates = nstates
+        self.state_width = state_width
+        self.batcher = MicroBatcher(policy, max_batch, max_delay)
+        self.server = None
+        return
+
+    async def _respond(self, writer, status, body):
+        payload = json.dumps(body).encode()
+        writer.write('HTTP/1.1 {0} {1}\r\nContent-Type: application/json\r\nContent-Length: {2}\r\n\r\n'.format(
+                     status, REASONS[status], len(payload)).encode() + payload)
+        await writer.drain()
+
+    async def _handle(self, method, path, body):
+        if method == 'GET' and path == '/stats':
+            return 200, self.batcher.stats.summary()
+        if method != 'POST' or path != '/order':
+            return 404, {'error' : 'unknown endpoint {0} {1}'.format(method, path)}
+
+        try:
+            state = np.asarray(json.loads(body)['state'], dtype = np.float64)
+        except (ValueError, KeyError, TypeError) as error:
+            return 400, {'error' : 'invalid request: {0}'.format(error)}
+        if state.shape != (self.nstates, self.state_width):
+            return 400, {'error' : 'state must be ({0}, {1}), got {2}'.format(self.nstates, self.state_width, state.shape)}
+
+        order, action = await self.batcher.submit(state)
+        return 200, {'order' : order , 'action' : action}
+
+    async def _connection(self, reader, writer):
+        # One connection may carry several requests (keep-alive).
+        try:
+            while True:
+                line = await reader.readline()
+                if not line:
+                    break
+                method, path, _ = line.decode('latin-1').split(' ', 2)
+                headers = {}
+                while True:
+                    header = (await reader.readline()).decode('latin-1').strip()
+                    if not header:
+                        break
+                    key, _, value = header.partition(':')
+                    headers[key.strip().lower()] = value.strip()
+                body = await reader.readexactly(int(headers.get('content-length', 0)))
+
+                try:
+                    status, response = await self._handle(method, path, body)
+                except Exception as error:
+                    status, response = 500, {'error' : str(error)}
+                await self._respond(writer, status, response)
+                if headers.get('connection', '').lower() == 'close':
+                    break
+        except (ValueError, asyncio.IncompleteReadError, ConnectionError):
+            pass
+        finally:
+            writer.close()
+
+    async def start(self, host = '127.0.0.1', port = 8000):
+        await self.batcher.start()
+        self.server = await asyncio.start_server(self._connection, host, port)
+        return self.server
+
+    async def stop(self):
+        self.server.close()
+        await self.server.wait_closed()
+        await self.batcher.stop()
+
+    async def serve(self, host = '127.0.0.1', port = 8000, report_every = 10):
+        """
+        -------------------------------------------------------
+        Serves until cancelled.
+        -------------------------------------------------------
+        Preconditions: report_every - seconds between two printed
+            stats lines, None for no reporting.
+        Postconditions: None.
+        -------------------------------------------------------
+        """
+        await self.start(host, port)
+        print('Serving on http://{0}:{1}'.format(host, port))
+        try:
+            while True:
+                await asyncio.sleep(report_every or 3600)
+                if report_every:
+                    s = self.batcher.stats.summary()
+                    print('{0} requests - p50 {1:.2f} ms - p99 {2:.2f} ms - {3:.0f} req/s - batch {4:.1f}'.format(
+                          s['requests'], s['p50_ms'], s['p99_ms'], s['throughput'], s['mean_batch']))
+        finally:
+            await self.stop()
+
+
+##############################################################################################
+
+
+async def _client(host, port, n_requests, nstates, state_width, latencies, rng):
+    reader, writer = await asyncio.open_connection(host, port)
+    for _ in range(n_requests):
+        payload = json.dumps({'state' : rng.integers(0, 40, (nstates, state_width)).tolist()}).encode()
+        start = time.perf_counter()
+        writer.write('POST /order HTTP/1.1\r\nHost: {0}\r\nContent-Length: {1}\r\n\r\n'.format(host, len(payload)).encode()
+                     + payload)
+        await writer.drain()
+        length = 0
+        while True:
+            header = (await reader.readline()).decode('latin-1').strip()
+            if not header:
+                break
+            if header.lower().startswith('content-length:'):
+                length = int(header.split(':')[1])
+        await reader.readexactly(length)
+        latencies.append(time.perf_counter() - start)
+    writer.close()
+
+
+async def benchmark(host = '127.0.0.1', port = 8000, n_requests = 10000, concurrency = 64, nstates = 10, seed = None,
+                    state_width = 5):
+    """
+    -------------------------------------------------------
+    Loads a running server with concurrent keep-alive clients.
+    -------------------------------------------------------
+    Preconditions: n_requests - the total number of requests, split
+            as evenly as possible over at most concurrency connections.
+    Postconditions: Returns the client-side p50/p99 latency in
+        milliseconds and throughput in requests per second.
+    -------------------------------------------------------
+    """
+    rng = np.random.default_rng(seed)
+    latencies = []
+    per_client, remainder = divmod(n_requests, concurrency)
+    counts = [per_client + (i < remainder) for i in range(concurrency)]
+    start = time.perf_counter()
+    await asyncio.gather(*[_client(host, port, count, nstates, state_width, latencies, rng) for count in counts if count > 0])
+    elapsed = time.perf_counter() - start
+
+    p50, p99 = np.percentile(np.asarray(latencies) * 1000, [50, 99])
+    return {'requests' : len(latencies) , 'p50_ms' : float(p50) , 'p99_ms' : float(p99) ,
+            'throughput' : len(latencies) / elapsed}
+
+
+def load_policy(path, nstates = 10, state_width = 5):
+    """
+    -------------------------------------------------------
+    Loads the policy to serve.
+    -------------------------------------------------------
+    Preconditions: path - a BatchRunner policy spec (.json) or a DQN
+        state_dict checkpoint.
+        nstates, state_width - the state windows served.
+    Postconditions: Returns the policy.
+    -------------------------------------------------------
+    """
+    from BatchRunner import build_policy
+    if path.endswith('.json'):
+        with open(path) as f:
+            return build_policy(json.load(f), nstates = nstates, state_width = state_width)
+    return build_policy({'type' : 'dqn', 'checkpoint' : path}, nstates = nstates, state_width = state_width)
+
+
+def main(argv = None):
+    parser = argparse.ArgumentParser(description = 'Serve beer game policy decisions locally, or benchmark a server.')
+    commands = parser.add_subparsers(dest = 'command')
+
+    serve = commands.add_parser('serve', help = 'serve a policy')
+    serve.add_argument('policy', help = 'a DQN checkpoint (.pt) or a policy spec (.json)')
+    serve.add_argument('--host', default = '127.0.0.1')
+    serve.add_argument('--port', type = int, default = 8000)
+    serve.add_argument('--nstates', type = int, default = 10)
+    serve.add_argument('--state-width', type = int, default = 5, help = '7 for extended states')
+    serve.add_argument('--max-batch', type = int, default = 256)
+    serve.add_argument('--max-delay-ms', type = float, default = 2.)
+    serve.add_argument('--report-every', type = float, default = 10.)
+
+    bench = commands.add_parser('bench', help = 'benchmark a running server')
+    bench.add_argument('--host', default = '127.0.0.1')
+    bench.add_argument('--port', type = int, default = 8000)
+    bench.add_argument('--nstates', type = int, default = 10)
+    bench.add_argument('--state-width', type = int, default = 5)
+    bench.add_argument('--requests', type = int, default = 10000)
+    bench.add_argument('--concurrency', type = int, default = 64)
+
+    args = parser.parse_args(argv)
+    if args.command == 'serve':
+        server = PolicyServer(load_policy(args.policy, args.nstates, args.state_width), args.nstates, args.max_batch, args.max_delay_ms / 1000,
+                              args.state_width)
+        try:
+            asyncio.run(server.serve(args.host, args.port, args.report_every))
+        except KeyboardInterrupt:
+            pass
+    elif args.command == 'bench':
+        results = asyncio.run(benchmark(args.host, args.port, args.requests, args.concurrency, args.nstates,
+                                        state_width = args.state_width))
+        print('{0} requests - p50 {1:.2f} ms - p99 {2:.2f} ms - {3:.0f} req/s'.format(
+              results['requests'], results['p50_ms'], results['p99_ms'], results['throughput']))
+    else:
+        parser.print_help()
+
+
+if __name__ == '__main__':
+    main()
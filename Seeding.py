@@ -0,0 +1,101 @@
+"""
+-------------------------------------------------------
+This file contains and defines the SeedManager class.
+-------------------------------------------------------
+A SeedManager wraps a numpy SeedSequence and hands out
+independent, reproducible random streams to simulations,
+worker processes and components (customer noise, exploration,
+replay sampling, network initialization). Streams are named,
+so the stream a component receives does not depend on the
+order in which the others were created.
+-------------------------------------------------------
+"""
+
+import random
+import zlib
+import numpy as np
+
+
+def _spawn_key(part):
+    return part if isinstance(part, (int, np.integer)) else zlib.crc32(str(part).encode())
+
+
+class SeedManager:
+
+    def __init__(self, seed = None, spawn_key = ()):
+        """
+        -------------------------------------------------------
+        Constructor for the SeedManager class.
+        -------------------------------------------------------
+        Preconditions: seed - the root entropy. None draws fresh
+                entropy, which record() still captures.
+            spawn_key - the path of this stream below the root.
+        Postconditions:
+            Initializes the SeedManager object.
+        -------------------------------------------------------
+        """
+        self.sequence = np.random.SeedSequence(seed, spawn_key = tuple(int(k) for k in spawn_key))
+        return
+
+    def child(self, *key):
+        """
+        -------------------------------------------------------
+        Returns the independent stream named key.
+        -------------------------------------------------------
+        Preconditions: key - ints or strings, e.g. child('trial', 3)
+            or child('retailer', 'policy').
+        Postconditions: Returns a SeedManager. The same key always
+            gives the same stream, and different keys give streams
+            that do not overlap.
+        -------------------------------------------------------
+        """
+        return SeedManager(self.sequence.entropy, self.sequence.spawn_key + tuple(_spawn_key(k) for k in key))
+
+    def generator(self):
+        """
+        -------------------------------------------------------
+        Returns a numpy Generator on this stream.
+        -------------------------------------------------------
+        Preconditions: None.
+        Postconditions: Each call returns a new Generator starting at
+            the beginning of the same stream; use child() to get
+            distinct streams.
+        -------------------------------------------------------
+        """
+        return np.random.Generator(np.random.PCG64(self.sequence))
+
+    def python_random(self):
+        return random.Random(int(self.sequence.generate_state(1, np.uint64)[0]))
+
+    def torch_seed(self):
+        return int(self.sequence.generate_state(1, np.uint64)[0])
+
+    def seed_torch(self):
+        """
+        -------------------------------------------------------
+        Seeds torch's global generator from this stream.
+        -------------------------------------------------------
+        Preconditions: Only call it once per process, e.g. at the start
+            of a worker: torch's generator is global.
+        Postconditions: Network initializations are reproducible.
+        -------------------------------------------------------
+        """
+        import torch
+        torch.manual_seed(self.torch_seed())
+        return
+
+    def record(self):
+        """
+        -------------------------------------------------------
+        Returns the stream's identity, to store with results.
+        -------------------------------------------------------
+        Preconditions: None.
+        Postconditions: Returns a JSON-serializable dict accepted by
+            from_record.
+        -------------------------------------------------------
+        """
+        return {'entropy' : int(self.sequence.entropy), 'spawn_key' : list(self.sequence.spawn_key)}
+
+    @classmethod
+    def from_record(cls, record):
+        return cls(record['entropy'], record['spawn_key'])
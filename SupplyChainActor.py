@@ -8,14 +8,138 @@ Version: February 7th 2016
 -------------------------------------------------------
 """
 
+from collections import deque
+import itertools
+import numpy as np
+
 
 STORAGE_COST_PER_UNIT = 0.5
 BACKORDER_PENALTY_COST_PER_UNIT = 1
 
+N_ACTORS = 4
+
+
+
+class CostModel:
+    
+    def __init__(self, holding = None, penalty = None, holdingExponent = 1, penaltyExponent = 1, lostSales = False):
+        """
+        -------------------------------------------------------
+        Constructor for the CostModel class. A cost model prices
+        every unit in stock and every unfilled unit of demand:
+            cost = holding * stock ** holdingExponent
+                 + penalty * unfilled ** penaltyExponent
+        -------------------------------------------------------
+        Preconditions:
+            holding, penalty, holdingExponent, penaltyExponent - scalars
+                or arrays. The last axis indexes the actors (retailer,
+                wholesaler, distributor, factory) and has size N_ACTORS
+                or 1; any leading axes form a grid of cost structures
+                evaluated side by side. Defaults to the module-level
+                STORAGE_COST_PER_UNIT and BACKORDER_PENALTY_COST_PER_UNIT.
+            lostSales - if True, demand that cannot be filled is lost
+                instead of back-ordered, and penalty prices lost units.
+        Postconditions:
+            Initializes the CostModel object.
+        -------------------------------------------------------
+        """
+        self.holding = self._AsParameter(STORAGE_COST_PER_UNIT if holding is None else holding)
+        self.penalty = self._AsParameter(BACKORDER_PENALTY_COST_PER_UNIT if penalty is None else penalty)
+        self.holdingExponent = self._AsParameter(holdingExponent)
+        self.penaltyExponent = self._AsParameter(penaltyExponent)
+        self.lostSales = lostSales
+        
+        self.gridShape = np.broadcast_shapes(*(p.shape[:-1] for p in self._Parameters()))
+        
+        #Plain floats for the common single-structure case, which is priced every turn.
+        self.scalarParameters = None
+        if self.gridShape == ():
+            self.scalarParameters = [tuple(float(p) for p in self.ForActor(i)) for i in range(N_ACTORS)]
+        return
+    
+    @staticmethod
+    def _AsParameter(value):
+        parameter = np.atleast_1d(np.asarray(value, dtype = np.float64))
+        if parameter.shape[-1] not in (1, N_ACTORS):
+            raise ValueError("The last axis of a cost parameter indexes the actors and must have size 1 or {0}".format(N_ACTORS))
+        return parameter
+    
+    def _Parameters(self):
+        return (self.holding, self.penalty, self.holdingExponent, self.penaltyExponent)
+    
+    @classmethod
+    def Grid(cls, lostSales = False, **axes):
+        """
+        -------------------------------------------------------
+        Builds the cartesian product of several cost parameters.
+        -------------------------------------------------------
+        Preconditions: axes - constructor parameter names mapped to
+            lists of values, e.g. Grid(holding = [0.5, 1], penalty = [1, 2, 4]).
+            A value may itself be a per-actor list.
+        Postconditions: Returns a CostModel whose grid has one entry per
+            combination, in itertools.product order.
+        -------------------------------------------------------
+        """
+        names = list(axes)
+        combinations = list(itertools.product(*(axes[name] for name in names)))
+        columns = {name : np.array([np.broadcast_to(np.atleast_1d(np.asarray(c[i], dtype = np.float64)), (N_ACTORS,))
+                                    for c in combinations]) for i, name in enumerate(names)}
+        return cls(lostSales = lostSales, **columns)
+    
+    def ForActor(self, actorIndex):
+        """
+        -------------------------------------------------------
+        Returns the parameters of one actor.
+        -------------------------------------------------------
+        Preconditions: actorIndex - 0 (retailer) to 3 (factory).
+        Postconditions: Returns (holding, penalty, holdingExponent,
+            penaltyExponent), each a scalar or an array of gridShape.
+        -------------------------------------------------------
+        """
+        return tuple(p[..., actorIndex if p.shape[-1] > 1 else 0] for p in self._Parameters())
+    
+    def CalcCost(self, stock, unfilled, actorIndex):
+        """
+        -------------------------------------------------------
+        Returns the cost of one actor's week.
+        -------------------------------------------------------
+        Preconditions: stock - units in stock at the end of the turn.
+            unfilled - units back-ordered (or lost, under lost sales).
+        Postconditions: Returns a float, or an array of gridShape when
+            the model holds a grid.
+        -------------------------------------------------------
+        """
+        if self.scalarParameters is not None:
+            holding, penalty, holdingExponent, penaltyExponent = self.scalarParameters[actorIndex]
+            return holding * stock ** holdingExponent + penalty * unfilled ** penaltyExponent
+        
+        holding, penalty, holdingExponent, penaltyExponent = self.ForActor(actorIndex)
+        return holding * np.power(float(stock), holdingExponent) + penalty * np.power(float(unfilled), penaltyExponent)
+    
+    def Evaluate(self, stock, unfilled):
+        """
+        -------------------------------------------------------
+        Prices whole trajectories under every cost structure at once.
+        -------------------------------------------------------
+        Preconditions: stock, unfilled - arrays whose last axis indexes
+            the actors, e.g. (runs, weeks, actors).
+        Postconditions: Returns (holdingCost, penaltyCost), two arrays
+            of shape gridShape + stock.shape.
+        -------------------------------------------------------
+        """
+        stock = np.asarray(stock, dtype = np.float64)
+        unfilled = np.asarray(unfilled, dtype = np.float64)
+        holding, penalty, holdingExponent, penaltyExponent = (
+            p.reshape(p.shape[:-1] + (1,) * (stock.ndim - 1) + p.shape[-1:]) for p in self._Parameters())
+        return holding * np.power(stock, holdingExponent), penalty * np.power(unfilled, penaltyExponent)
+
 
 class SupplyChainActor:
     
-    def __init__(self, policy , nstates , initial_stock , incomingOrdersQueue, outgoingOrdersQueue, incomingDeliveriesQueue, outgoingDeliveriesQueue):
+    #Position of the actor in the chain, used to pick its cost parameters.
+    ACTOR_INDEX = 0
+    
+    def __init__(self, policy , nstates , initial_stock , incomingOrdersQueue, outgoingOrdersQueue, incomingDeliveriesQueue, outgoingDeliveriesQueue, costModel = None, extendedState = False):
         """
         -------------------------------------------------------
         Constructor for the SupplyChainActor class. All other
@@ -27,6 +151,11 @@ class SupplyChainActor:
             outgoingOrdersQueue - queue for outgoing orders.
             incomingDeliveriesQueue - queue for incoming deliveries.
             outgoingDeliveriesQueue - queue for outgoing deliveries.
+            costModel - the CostModel pricing the actor's weeks. Defaults
+                to the module-level per-unit costs.
+            extendedState - if True, every state row also holds the
+                on-order pipeline and the inventory position, so rows
+                have 7 entries instead of 5.
             
         Postconditions:
             Initializes the SupplyChainActor object in its initial state.
@@ -36,21 +165,42 @@ class SupplyChainActor:
         self.currentOrders = 0
         self.costsIncurred = 0
         
+        self.costModel = CostModel() if costModel is None else costModel
+        self.lostSales = 0
+        self.lostThisTurn = 0
+        
         self.incomingOrdersQueue = incomingOrdersQueue
         self.outgoingOrdersQueue = outgoingOrdersQueue
         self.incomingDeliveriesQueue = incomingDeliveriesQueue
         self.outgoingDeliveriesQueue = outgoingDeliveriesQueue
         
         self.lastOrderQuantity = 0
+        
+        #Running totals, kept up to date on every push and pop.
+        self.cumulativeOrdered = 0
+        self.cumulativeReceived = 0
+        self.cumulativeShipped = 0
+        #What is already in the queues when the game starts is on order too.
+        self.onOrder = self.InTransit(self.outgoingOrdersQueue) + self.InTransit(self.incomingDeliveriesQueue)
+        #The actor this one ships to, set by the simulator : its lost orders leave that actor's pipeline.
+        self.downstream = None
+        
+        self.extendedState = extendedState
+        self.stateWidth = 7 if extendedState else 5
 
 
         self.policy = policy
         self.nstates = nstates
-        self.states = []
+        #Only the last nstates weeks are ever part of the state.
+        self.states = deque(maxlen = nstates)
 
 
         return
     
+    @staticmethod
+    def InTransit(queue):
+        return 0 if queue is None else queue.total
+    
     def PlaceOutgoingDelivery(self, amountToDeliver):
         """
         -------------------------------------------------------
@@ -80,7 +230,8 @@ class SupplyChainActor:
         """
         amountToOrder , policy_action = self.policy.calculate_order( state )
 
-        self.outgoingOrdersQueue.PushEnvelope(amountToOrder)
+        if self.outgoingOrdersQueue.PushEnvelope(amountToOrder):
+            self.RecordOrderPlaced(amountToOrder)
         self.lastOrderQuantity = amountToOrder
         
         return policy_action
@@ -102,9 +253,22 @@ class SupplyChainActor:
         
         if quantityReceived > 0:
             self.currentStock += quantityReceived
+            self.RecordDeliveryReceived(quantityReceived)
                 
         return quantityReceived
     
+    def RecordOrderPlaced(self, amountOrdered):
+        #Negative orders are ignored upstream, so they never reach the pipeline.
+        if amountOrdered > 0:
+            self.cumulativeOrdered += amountOrdered
+            self.onOrder += amountOrdered
+        return
+    
+    def RecordDeliveryReceived(self, quantityReceived):
+        self.cumulativeReceived += quantityReceived
+        self.onOrder -= quantityReceived
+        return
+    
     def ReceiveIncomingOrders(self):
         """
         -------------------------------------------------------
@@ -140,6 +304,7 @@ class SupplyChainActor:
         -------------------------------------------------------
         """
         deliveryQuantity = 0
+        self.lostThisTurn = 0
         
          #If we can fill the customer's order, we must do it.
         if self.currentStock >= self.currentOrders:
@@ -151,6 +316,16 @@ class SupplyChainActor:
             deliveryQuantity = self.currentStock
             self.currentStock = 0
             self.currentOrders -= deliveryQuantity
+        
+        self.cumulativeShipped += deliveryQuantity
+        
+        #Under lost sales, whatever could not be filled is gone, and will never reach the downstream actor.
+        if self.costModel.lostSales and self.currentOrders > 0:
+            self.lostThisTurn = self.currentOrders
+            self.lostSales += self.currentOrders
+            if self.downstream is not None:
+                self.downstream.onOrder -= self.currentOrders
+            self.currentOrders = 0
 
         return deliveryQuantity
     
@@ -164,15 +339,11 @@ class SupplyChainActor:
             sequence to account for orders taken and deliveries.
         Postconditions:
             Returns costsThisTurn - the total cost incurred during
-            this turn.
+            this turn, an array when the cost model holds a grid.
         -------------------------------------------------------
         """
-        costsThisTurn = 0
-        
-        inventoryStorageCost = self.currentStock * STORAGE_COST_PER_UNIT
-        backorderPenaltyCost = self.currentOrders * BACKORDER_PENALTY_COST_PER_UNIT
-        
-        costsThisTurn = inventoryStorageCost + backorderPenaltyCost
+        unfilled = self.lostThisTurn if self.costModel.lostSales else self.currentOrders
+        costsThisTurn = self.costModel.CalcCost(self.currentStock, unfilled, self.ACTOR_INDEX)
         
         return costsThisTurn
     
@@ -210,6 +381,42 @@ class SupplyChainActor:
         -------------------------------------------------------
         """
         return (self.currentStock - self.currentOrders)
+    
+    def CalcInventoryPosition(self):
+        """
+        -------------------------------------------------------
+        Returns the inventory position of the calling SupplyChainActor.
+        -------------------------------------------------------
+        Preconditions: None.
+        Postconditions: Returns the effective inventory plus the
+            on-order pipeline : every unit ordered (or put into
+            production) and not received yet, including the initial
+            envelopes of the queues. Orders dropped by a full queue
+            never enter the pipeline, and under lost sales the orders
+            the upstream actor could not fill leave it.
+        -------------------------------------------------------
+        """
+        return self.currentStock - self.currentOrders + self.onOrder
+    
+    def ExtendState(self, curr_state):
+        """
+        -------------------------------------------------------
+        Completes a state row with the pipeline features.
+        -------------------------------------------------------
+        Preconditions: curr_state - the row built in TakeTurn, after
+            the delivery and the orders were received.
+        Postconditions: Returns the row unchanged unless extendedState
+            is set. Otherwise a missing in-transit entry (empty queue)
+            is filled with 0, and onOrder and the inventory position
+            are appended.
+        -------------------------------------------------------
+        """
+        if not self.extendedState:
+            return curr_state
+        if len(curr_state) < 5:
+            curr_state.append(0)
+        curr_state.extend([self.onOrder , self.CalcInventoryPosition()])
+        return curr_state
 
 
 
@@ -234,6 +441,8 @@ class SupplyChainQueue():
         """
         self.queueLength = queueLength
         self.data = []
+        #Sum of the envelopes in the queue.
+        self.total = 0
         return
     
     def PushEnvelope(self, numberOfCasesToOrder):
@@ -251,6 +460,7 @@ class SupplyChainQueue():
         
         if len(self.data) < self.queueLength:
             self.data.append(numberOfCasesToOrder)
+            self.total += numberOfCasesToOrder
             orderSuccessfullyPlaced = True
             
         return orderSuccessfullyPlaced
@@ -266,7 +476,7 @@ class SupplyChainQueue():
             to index [0], item at index [2] is moved to index [1], etc...
         -------------------------------------------------------
         """
-        self.data.pop(0)
+        self.total -= self.data.pop(0)
         return
     
     def PopEnvelope(self):
@@ -0,0 +1,177 @@
+"""
+-------------------------------------------------------
+This file contains vectorized supply chain KPIs.
+-------------------------------------------------------
+Every function works on a whole batch of runs at once. The
+trajectories are arrays of shape (runs, weeks, actors), with
+the actors in TrajectoryStore.ACTORS order:
+    demand - orders received by each actor during the week.
+    orders - orders placed by each actor.
+    stock - stock at the end of the actor's turn.
+    backorders - unfilled orders at the end of the actor's turn.
+    lost - demand lost during the week, under a lost-sales
+        CostModel (where backorders stay at 0).
+-------------------------------------------------------
+"""
+
+import numpy as np
+
+from SupplyChainActor import CostModel
+from TrajectoryStore import ACTORS
+
+
+def _ratio(numerator, denominator):
+    numerator, denominator = np.broadcast_arrays(np.asarray(numerator, dtype = np.float64),
+                                                 np.asarray(denominator, dtype = np.float64))
+    return np.divide(numerator, denominator, out = np.full(numerator.shape, np.nan), where = denominator > 0)
+
+
+def bullwhip(orders, demand):
+    """
+    -------------------------------------------------------
+    Computes the order variance amplification of each echelon.
+    -------------------------------------------------------
+    Preconditions: orders, demand - (runs, weeks, actors) arrays.
+    Postconditions: Returns two (runs, actors) arrays: the variance
+        of the orders placed over the variance of the orders received
+        by the same actor, and over the variance of the customer
+        demand (the retailer's received orders). Runs with constant
+        demand have no defined ratio and give NaN.
+    -------------------------------------------------------
+    """
+    order_variance = orders.var(axis = 1)
+    demand_variance = demand.var(axis = 1)
+    return _ratio(order_variance, demand_variance), _ratio(order_variance, demand_variance[:, :1])
+
+
+def fill_rate(demand, backorders):
+    """
+    -------------------------------------------------------
+    Computes the fraction of demand shipped in the week it arrived.
+    -------------------------------------------------------
+    Preconditions: demand, backorders - (runs, weeks, actors) arrays.
+    Postconditions: Returns a (runs, actors) array. Backorders are
+        served first, so the new demand filled in a week is
+        demand - backorders, clipped to [0, demand].
+    -------------------------------------------------------
+    """
+    demand = np.maximum(demand, 0)
+    filled = np.clip(demand - backorders, 0, demand)
+    return _ratio(filled.sum(axis = 1), demand.sum(axis = 1))
+
+
+def stockout_frequency(backorders):
+    """
+    -------------------------------------------------------
+    Computes the fraction of weeks ending with unfilled orders.
+    -------------------------------------------------------
+    Preconditions: backorders - a (runs, weeks, actors) array.
+    Postconditions: Returns a (runs, actors) array.
+    -------------------------------------------------------
+    """
+    return (backorders > 0).mean(axis = 1)
+
+
+def cost_decomposition(stock, backorders, costModel = None, lost = None):
+    """
+    -------------------------------------------------------
+    Splits the total cost of each actor into holding and backorder
+    (or lost sales) costs.
+    -------------------------------------------------------
+    Preconditions: stock, backorders - (runs, weeks, actors) arrays.
+        costModel - the CostModel to price them with, the default
+            unit costs if None. Every structure of a CostModel grid
+            is evaluated in the same pass.
+        lost - a (runs, weeks, actors) array, required when costModel
+            has lostSales : the penalty then prices the lost units
+            instead of the backorders.
+    Postconditions: Returns two arrays of shape costModel.gridShape +
+        (runs, actors), the holding and the penalty costs, which sum
+        to CalcCostForTurn's total. Raises ValueError for a lost-sales
+        model without lost.
+    -------------------------------------------------------
+    """
+    costModel = CostModel() if costModel is None else costModel
+    unfilled = backorders
+    if costModel.lostSales:
+        if lost is None:
+            raise ValueError('A lost-sales CostModel prices the lost units : pass lost')
+        unfilled = lost
+    holding, penalty = costModel.Evaluate(stock, unfilled)
+    return holding.sum(axis = -2), penalty.sum(axis = -2)
+
+
+def summarize(demand, orders, stock, backorders, costModel = None, lost = None):
+    """
+    -------------------------------------------------------
+    Computes every KPI of a batch of runs.
+    -------------------------------------------------------
+    Preconditions: see the module description. costModel, lost - see
+        cost_decomposition.
+    Postconditions: Returns a dict of (runs, actors) arrays; the cost
+        entries have the cost model's grid axes in front. Lost units
+        count as unfilled in the fill rate and stockout frequency.
+    -------------------------------------------------------
+    """
+    local, cumulative = bullwhip(orders, demand)
+    holding, backorder = cost_decomposition(stock, backorders, costModel, lost)
+    unfilled = backorders if lost is None else backorders + lost
+    return {'bullwhip' : local,
+            'cumulative_bullwhip' : cumulative,
+            'fill_rate' : fill_rate(demand, unfilled),
+            'stockout_frequency' : stockout_frequency(unfilled),
+            'holding_cost' : holding,
+            'backorder_cost' : backorder,
+            'total_cost' : holding + backorder}
+
+
+def trajectory_arrays(columns, n_actors = len(ACTORS), lost = False):
+    """
+    -------------------------------------------------------
+    Reshapes trajectory store columns into KPI inputs.
+    -------------------------------------------------------
+    Preconditions: columns - a TrajectoryReader or one of its
+        iter_chunks() dicts, covering whole episodes of equal length
+        written with TrajectoryWriter.record_step.
+        lost - whether to return the lost units too.
+    Postconditions: Returns the demand, orders, stock and backorders
+        arrays of shape (runs, weeks, actors), followed by the lost
+        array with lost. Raises ValueError if lost is asked of a store
+        that does not record it.
+    -------------------------------------------------------
+    """
+    episode = np.asarray(columns['episode'])
+    n_runs = len(np.unique(episode))
+    shape = (n_runs, -1, n_actors)
+    if len(episode) % (n_runs * n_actors) != 0:
+        raise ValueError('Episodes of unequal length cannot be batched')
+    demand = np.asarray(columns['state'][:, -1, 3], dtype = np.float64).reshape(shape)
+    arrays = (demand,
+              np.asarray(columns['order'], dtype = np.float64).reshape(shape),
+              np.asarray(columns['stock'], dtype = np.float64).reshape(shape),
+              np.asarray(columns['backorders'], dtype = np.float64).reshape(shape))
+    if lost:
+        if 'lost' not in getattr(columns, 'columns', columns):
+            raise ValueError('The store does not record lost units')
+        arrays += (np.asarray(columns['lost'], dtype = np.float64).reshape(shape),)
+    return arrays
+
+
+def summarize_store(reader, weeks, runs_per_chunk = 1000, costModel = None):
+    """
+    -------------------------------------------------------
+    Computes every KPI of a trajectory store, a block of runs at a
+    time.
+    -------------------------------------------------------
+    Preconditions: reader - a TrajectoryReader of episodes all lasting
+            weeks weeks.
+        runs_per_chunk - the number of runs loaded at once.
+    Postconditions: Returns the summarize() dict over all runs.
+    -------------------------------------------------------
+    """
+    lostSales = costModel is not None and costModel.lostSales
+    blocks = []
+    for chunk in reader.iter_chunks(runs_per_chunk * weeks * len(reader.actors)):
+        arrays = trajectory_arrays(chunk, lost = lostSales)
+        blocks.append(summarize(*arrays[:4], costModel = costModel, lost = arrays[4] if lostSales else None))
+    return {key : np.concatenate([block[key] for block in blocks], axis = -2) for key in blocks[0]}
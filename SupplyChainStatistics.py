@@ -8,7 +8,12 @@ Version: February 15th 2016
 -------------------------------------------------------
 """
 
-import matplotlib.pyplot as plt
+from collections import deque
+
+import numpy as np
+
+#matplotlib is imported by the Plot* methods only, so that simulations
+#which never plot do not pay for it.
 
 class SupplyChainStatistics:
     
@@ -223,6 +228,7 @@ class SupplyChainStatistics:
         Postconditions: Outputs MatplotLib chart.
         -------------------------------------------------------
         """
+        import matplotlib.pyplot as plt
         plt.title("Cost Incurred Over Time")
         plt.plot(self.retailerCostsOverTime, "r", label = "Retailer")
         plt.plot(self.wholesalerCostsOverTime, "g", label = "Wholesaler")
@@ -244,6 +250,7 @@ class SupplyChainStatistics:
         Postconditions: Outputs MatplotLib chart.
         -------------------------------------------------------
         """
+        import matplotlib.pyplot as plt
         plt.title("Orders Placed Over Time")
         plt.plot(self.retailerOrdersOverTime, "r", label = "Retailer")
         plt.plot(self.wholesalerOrdersOverTime, "g", label = "Wholesaler")
@@ -265,6 +272,7 @@ class SupplyChainStatistics:
         Postconditions: Outputs MatplotLib chart.
         -------------------------------------------------------
         """
+        import matplotlib.pyplot as plt
         plt.title("Effective Inventory Over Time")
         plt.plot(self.retailerEffectiveInventoryOverTime, "r", label = "Retailer")
         plt.plot(self.wholesalerEffectiveInventoryOverTime, "g", label = "Wholesaler")
@@ -277,4 +285,130 @@ class SupplyChainStatistics:
         
         return
     
-    
\ No newline at end of file
+    
+
+
+###########################################################################
+
+
+
+class WindowedSupplyChainStatistics:
+    
+    ACTORS = ('retailer', 'wholesaler', 'distributor', 'factory')
+    QUANTITIES = ('cost', 'orders', 'effectiveInventory')
+    
+    def __init__(self, window = 52, sink = None, keep = 100):
+        """
+        -------------------------------------------------------
+        Constructor for the WindowedSupplyChainStatistics class.
+        It has the same Record* interface as SupplyChainStatistics
+        but only keeps running aggregates, so its memory does not
+        grow with the number of weeks played.
+        -------------------------------------------------------
+        Preconditions: window - the number of weeks per aggregate.
+            sink - optional callable receiving each completed window.
+            keep - the number of most recent windows kept in memory.
+        Postconditions: Initializes empty aggregates.
+        -------------------------------------------------------
+        """
+        self.window = window
+        self.sink = sink
+        self.windows = deque(maxlen = keep)
+        
+        self.weeksRecorded = {actor : 0 for actor in self.ACTORS}
+        self.lastCost = {actor : 0 for actor in self.ACTORS}
+        self._ResetWindow()
+        return
+    
+    def _ResetWindow(self):
+        self.current = {actor : {quantity : [0, 0., 0., float('inf'), -float('inf'), 0.] for quantity in self.QUANTITIES}
+                        for actor in self.ACTORS}
+        self.windowStartCost = dict(self.lastCost)
+        return
+    
+    def _Record(self, actor, quantity, value):
+        #[count, sum, sum of squares, min, max, last]
+        aggregate = self.current[actor][quantity]
+        aggregate[0] += 1
+        aggregate[1] += value
+        aggregate[2] += value * value
+        #Element-wise, for the cost arrays of a CostModel grid.
+        aggregate[3] = np.minimum(aggregate[3], value)
+        aggregate[4] = np.maximum(aggregate[4], value)
+        aggregate[5] = value
+        
+        if quantity == 'cost':
+            self.lastCost[actor] = value
+        #The factory records last in a week, so its inventory closes the week.
+        if actor == 'factory' and quantity == 'effectiveInventory':
+            self.weeksRecorded[actor] += 1
+            if self.weeksRecorded[actor] % self.window == 0:
+                self.CloseWindow()
+        return
+    
+    def CloseWindow(self):
+        """
+        -------------------------------------------------------
+        Summarizes the current window and starts a new one.
+        -------------------------------------------------------
+        Preconditions: None.
+        Postconditions: A dict per actor with the mean, std, min, max
+            and last value of each quantity, plus the cost incurred
+            during the window, is appended to self.windows and passed
+            to the sink. Empty windows are ignored.
+        -------------------------------------------------------
+        """
+        if self.current['factory']['effectiveInventory'][0] == 0:
+            return
+        
+        summary = {'endWeek' : self.weeksRecorded['factory']}
+        for actor in self.ACTORS:
+            summary[actor] = {}
+            for quantity in self.QUANTITIES:
+                count, total, squares, low, high, last = self.current[actor][quantity]
+                mean = total / count
+                summary[actor][quantity] = {'mean' : mean, 'std' : np.maximum(squares / count - mean * mean, 0.) ** 0.5,
+                                            'min' : low, 'max' : high, 'last' : last}
+            summary[actor]['windowCost'] = self.lastCost[actor] - self.windowStartCost[actor]
+        
+        self.windows.append(summary)
+        if self.sink is not None:
+            self.sink(summary)
+        self._ResetWindow()
+        return
+    
+    def RecordRetailerOrders(self, retailerOrdersThisWeek):
+        self._Record('retailer', 'orders', retailerOrdersThisWeek)
+    
+    def RecordWholesalerOrders(self, wholesalerOrdersThisWeek):
+        self._Record('wholesaler', 'orders', wholesalerOrdersThisWeek)
+    
+    def RecordDistributorOrders(self, distributorOrdersThisWeek):
+        self._Record('distributor', 'orders', distributorOrdersThisWeek)
+    
+    def RecordFactoryOrders(self, factoryOrdersThisWeek):
+        self._Record('factory', 'orders', factoryOrdersThisWeek)
+    
+    def RecordRetailerCost(self, retailerCostsThisWeek):
+        self._Record('retailer', 'cost', retailerCostsThisWeek)
+    
+    def RecordWholesalerCost(self, wholesalerCostsThisWeek):
+        self._Record('wholesaler', 'cost', wholesalerCostsThisWeek)
+    
+    def RecordDistributorCost(self, distributorCostsThisWeek):
+        self._Record('distributor', 'cost', distributorCostsThisWeek)
+    
+    def RecordFactoryCost(self, factoryCostsThisWeek):
+        self._Record('factory', 'cost', factoryCostsThisWeek)
+    
+    def RecordRetailerEffectiveInventory(self, retailerEffectiveInventoryThisWeek):
+        self._Record('retailer', 'effectiveInventory', retailerEffectiveInventoryThisWeek)
+    
+    def RecordWholesalerEffectiveInventory(self, wholesalerEffectiveInventoryThisWeek):
+        self._Record('wholesaler', 'effectiveInventory', wholesalerEffectiveInventoryThisWeek)
+    
+    def RecordDistributorEffectiveInventory(self, distributorEffectiveInventoryThisWeek):
+        self._Record('distributor', 'effectiveInventory', distributorEffectiveInventoryThisWeek)
+    
+    def RecordFactoryEffectiveInventory(self, factoryEffectiveInventoryThisWeek):
+        self._Record('factory', 'effectiveInventory', factoryEffectiveInventoryThisWeek)
@@ -0,0 +1,223 @@
+"""
+-------------------------------------------------------
+This file contains the hyperparameter sweep runner.
+-------------------------------------------------------
+Each trial trains the retailer (and, after LAG_WHOLESALER
+episodes, the wholesaler) DQN policy in its own worker process,
+as the "Two Agents training - delay" notebook cells do. Every
+eval_every episodes a trial reports its evaluated chain cost; it
+is pruned when it trails both the OrderPolicy baseline and the
+median of the other trials at the same episode (median stopping
+rule). The baseline and every report are evaluated on the same
+demand draws, so that the comparison is like-for-like even with
+noisy demand.
+-------------------------------------------------------
+"""
+
+from concurrent.futures import ProcessPoolExecutor, as_completed
+import copy
+import itertools
+import multiprocessing
+
+import numpy as np
+
+from BeerGameSimulator import beer_game_Simulator, OrderPolicy
+from Seeding import SeedManager
+
+
+DEFAULT_CONFIG = {'BATCH_SIZE' : 32 ,
+                  'GAMMA' : 1 ,
+                  'TARGET_UPDATE' : 10 ,
+                  'MEMORY' : 10000 ,
+                  'STOP_TRAINING' : 400 ,
+                  'LEARNING_RATE' : 0.0001 ,
+                  'EPS_DECAY' : 36500/2 ,
+                  'LAG_WHOLESALER' : 100}
+
+
+class TrialPruned(Exception):
+    pass
+
+
+def grid(**space):
+    """
+    -------------------------------------------------------
+    Builds the cartesian product of a search space.
+    -------------------------------------------------------
+    Preconditions: space - DEFAULT_CONFIG keys mapped to lists of
+        values, e.g. grid(BATCH_SIZE = [32, 64], EPS_DECAY = [1e4, 2e4]).
+    Postconditions: Returns a list of complete trial configs.
+    -------------------------------------------------------
+    """
+    keys = list(space)
+    return [dict(DEFAULT_CONFIG, **dict(zip(keys, values))) for values in itertools.product(*(space[k] for k in keys))]
+
+
+def evaluation_simulator(simulator , eval_seed):
+    # A fresh copy of simulator whose games replay the demand draws of eval_seed.
+    return beer_game_Simulator(simulator.theCustomer , simulator.initial_orders , simulator.initial_stock ,
+                               simulator.queue_delay_weeks , simulator.cost_model , SeedManager.from_record(eval_seed) ,
+                               simulator.extended_state)
+
+
+def train_trial(config , simulator , base_policy , num_episodes , eval_every , n_eval_sims , report , seeds = None ,
+                eval_seed = None):
+    """
+    -------------------------------------------------------
+    Trains the retailer and wholesaler policies of one trial.
+    -------------------------------------------------------
+    Preconditions: config - a trial config, see DEFAULT_CONFIG.
+        base_policy - the policy of the actors not being trained.
+        report - called as report(episode, cost) every eval_every
+            episodes with the mean total chain cost; it raises
+            TrialPruned to stop the trial.
+        seeds - an optional SeedManager for exploration and replay
+            sampling.
+        eval_seed - an optional SeedManager record : every report then
+            evaluates on the same n_eval_sims demand draws. By default
+            the evaluation games continue the training simulator's
+            draws.
+    Postconditions: Returns the [retailer, wholesaler] DQN_Policy
+        objects, out of training mode.
+    -------------------------------------------------------
+    """
+    import torch.optim as optim
+    from DQN import DQN, DQN_Policy, ReplayMemory, optimize_model, transition_variables, to_tensors, device
+
+    lag , stop = config['LAG_WHOLESALER'] , config['STOP_TRAINING']
+
+    agents = {}
+    for key , lr in (('retailer' , config['LEARNING_RATE']) , ('wholesaler' , config['LEARNING_RATE']*0.5)):
+        policy = DQN_Policy(DQN(simulator.nstates , simulator.stateWidth).to(device) , train = True , eps_decay = config['EPS_DECAY'] ,
+                            rng = seeds.child(key , 'policy').generator() if seeds else None)
+        target_net = DQN(simulator.nstates , simulator.stateWidth).to(device)
+        target_net.load_state_dict(policy.network.state_dict())
+        memory = ReplayMemory(config['MEMORY'] , rng = seeds.child(key , 'memory').python_random() if seeds else None)
+        agents[key] = {'policy' : policy , 'target' : target_net , 'memory' : memory ,
+                       'optimizer' : optim.RMSprop(policy.network.parameters() , lr = lr)}
+
+    retailer_policy , wholesaler_policy = agents['retailer']['policy'] , agents['wholesaler']['policy']
+
+    for i_episode in range(num_episodes):
+
+        # Episodes in which each agent plays and learns
+        learning = {'retailer' : i_episode < stop ,
+                    'wholesaler' : lag < i_episode < lag + stop}
+        playing = {'retailer' : True , 'wholesaler' : i_episode > lag}
+
+        policies = [retailer_policy , wholesaler_policy if playing['wholesaler'] else base_policy , base_policy , base_policy]
+        simulator.init_simulation(*policies)
+
+        step_returns = simulator.step()
+        variables = {key : transition_variables(step_returns , key) for key in agents if playing[key]}
+
+        for t in range(simulator.weeks_to_play - 1):
+            step_returns = simulator.step()
+
+            for key , agent in agents.items():
+                if not learning[key]:
+                    continue
+                next_variables = transition_variables(step_returns , key)
+                agent['memory'].push(*to_tensors(variables[key] + (next_variables[0] ,)))
+                variables[key] = next_variables
+                optimize_model(agent['policy'].network , agent['target'] , agent['optimizer'] , agent['memory'] ,
+                               config['BATCH_SIZE'] , config['GAMMA'])
+                agent['policy'].n_steps += 1
+
+        # Update the target networks
+        if i_episode % config['TARGET_UPDATE'] == 0:
+            for key , agent in agents.items():
+                if playing[key]: agent['target'].load_state_dict(agent['policy'].network.state_dict())
+
+        if (i_episode + 1) % eval_every == 0:
+            evaluator = simulator if eval_seed is None else evaluation_simulator(simulator , eval_seed)
+            report(i_episode + 1 , sum(evaluator.evaluate_costs(n_eval_sims , policies)))
+
+    retailer_policy.train = wholesaler_policy.train = False
+    return [retailer_policy , wholesaler_policy]
+
+
+def _run_trial(trial , config , customer , initial_order , initial_stock , num_episodes , eval_every , n_eval_sims ,
+               baseline , min_trials , history , lock , seed , eval_seed):
+    """
+    -------------------------------------------------------
+    Worker entry point: runs one trial and returns its record.
+    -------------------------------------------------------
+    """
+    import torch
+    # One process per trial already keeps the cores busy.
+    torch.set_num_threads(1)
+
+    seeds = SeedManager.from_record(seed)
+    seeds.child('torch').seed_torch()
+
+    simulator = beer_game_Simulator(customer , initial_order , initial_stock , seeds = seeds.child('simulator'))
+    reports = []
+
+    def report(episode , cost):
+        reports.append((episode , cost))
+        with lock:
+            peers = history.get(episode , [])
+            history[episode] = peers + [cost]
+        print('TRIAL {0} - EPISODE {1} : cost {2:.1f} (baseline {3:.1f})'.format(trial , episode , cost , baseline))
+        # A trial that trained every episode is complete, whatever its last report.
+        if episode < num_episodes and len(peers) >= min_trials and cost > baseline and cost > np.median(peers):
+            raise TrialPruned()
+
+    try:
+        train_trial(config , simulator , OrderPolicy(initial_stock) , num_episodes , eval_every , n_eval_sims , report , seeds ,
+                    eval_seed)
+        status = 'completed'
+    except TrialPruned:
+        status = 'pruned'
+
+    return {'trial' : trial , 'config' : config , 'seed' : seed , 'status' : status , 'reports' : reports ,
+            'episodes' : reports[-1][0] if reports else 0 ,
+            'cost' : reports[-1][1] if reports else np.inf}
+
+
+def run_sweep(configs , customer , initial_order = 5 , initial_stock = 30 , num_episodes = 500 , eval_every = 25 ,
+              n_eval_sims = 1 , n_workers = None , min_trials = 3 , seed = None):
+    """
+    -------------------------------------------------------
+    Runs every trial config in parallel worker processes.
+    -------------------------------------------------------
+    Preconditions: configs - a list of trial configs, e.g. from grid().
+        customer - the Customer whose demand every trial plays.
+        eval_every - episodes between two cost reports.
+        n_workers - the number of processes, one per core by default.
+        min_trials - the number of earlier reports at an episode needed
+            before a trial can be pruned there.
+        seed - the root seed. Each trial gets its own stream, so a
+            trial is reproduced by its config and seed record alone.
+    Postconditions: Returns one record per trial (config, seed record,
+        status, reports, last reported cost), completed trials first,
+        then by cost. The
+        OrderPolicy baseline cost is returned alongside.
+    -------------------------------------------------------
+    """
+    seeds = SeedManager(seed)
+    customer = copy.copy(customer)
+
+    base_policy = OrderPolicy(initial_stock)
+    # The baseline and every trial report play the same evaluation games.
+    eval_seed = seeds.child('evaluation').record()
+    baseline_simulator = beer_game_Simulator(customer , initial_order , initial_stock , seeds = SeedManager.from_record(eval_seed))
+    baseline = sum(baseline_simulator.evaluate_costs(n_eval_sims , [base_policy]*4))
+
+    results = []
+    with multiprocessing.Manager() as manager:
+        history , lock = manager.dict() , manager.Lock()
+        with ProcessPoolExecutor(n_workers) as pool:
+            futures = [pool.submit(_run_trial , trial , dict(DEFAULT_CONFIG , **config) , customer , initial_order ,
+                                   initial_stock , num_episodes , eval_every , n_eval_sims , baseline , min_trials ,
+                                   history , lock , seeds.child('trial' , trial).record() , eval_seed)
+                       for trial , config in enumerate(configs)]
+            for future in as_completed(futures):
+                result = future.result()
+                print('TRIAL {0} {1} after {2} episodes : cost {3:.1f}'.format(result['trial'] , result['status'].upper() ,
+                                                                             result['episodes'] , result['cost']))
+                results.append(result)
+
+    # Completed trials first : a pruned trial's cost comes from an earlier episode.
+    return sorted(results , key = lambda r: (r['status'] != 'completed' , r['cost'])) , baseline
@@ -0,0 +1,276 @@
+"""
+-------------------------------------------------------
+This file contains and defines the TrajectoryWriter and
+TrajectoryReader classes.
+-------------------------------------------------------
+A trajectory store is a directory holding one raw binary
+file per column plus a meta.json header. The writer appends
+fixed-size chunks so memory stays bounded whatever the number
+of episodes, and the reader memory-maps every column back.
+-------------------------------------------------------
+"""
+
+import json
+import os
+import numpy as np
+
+
+ACTORS = ('retailer', 'wholesaler', 'distributor', 'factory')
+
+META_FILE = 'meta.json'
+
+
+def _columns(nstates, state_width = 5):
+    """
+    -------------------------------------------------------
+    Returns the (name, dtype, row shape) layout of a store.
+    -------------------------------------------------------
+    Preconditions: nstates - the number of weeks in a state window.
+        state_width - the number of entries of a state row, 7 for
+            extended states.
+    Postconditions: Returns a list of column descriptions.
+    -------------------------------------------------------
+    """
+    return [('episode', 'int64', ()),
+            ('week', 'int32', ()),
+            ('actor', 'int8', ()),
+            ('state', 'float32', (nstates, state_width)),
+            ('action', 'int32', ()),
+            ('order', 'float32', ()),
+            ('reward', 'float32', ()),
+            ('stock', 'float32', ()),
+            ('backorders', 'float32', ()),
+            ('lost', 'float32', ()),
+            ('cost', 'float32', ())]
+
+
+class TrajectoryWriter:
+
+    def __init__(self, path, nstates = 10, chunk_size = 65536, metadata = None, state_width = 5):
+        """
+        -------------------------------------------------------
+        Constructor for the TrajectoryWriter class.
+        -------------------------------------------------------
+        Preconditions: path - the store directory. It is created if
+                needed; records are appended to an existing store.
+            nstates - the number of weeks in a state window.
+            chunk_size - the number of records buffered in memory
+                before they are written out.
+            metadata - a JSON-serializable dict saved in meta.json,
+                e.g. the SeedManager record the runs were drawn from.
+            state_width - the number of entries of a state row : the
+                simulator's stateWidth, 7 when it plays extended states.
+        Postconditions:
+            Initializes the column buffers. Column files longer than
+            meta.json's row count (a flush interrupted before meta.json
+            was rewritten) are truncated back to it, so that appended
+            rows stay aligned across columns.
+        -------------------------------------------------------
+        """
+        self.path = path
+        self.nstates = nstates
+        self.state_width = state_width
+        self.chunk_size = chunk_size
+        self.layout = _columns(nstates, state_width)
+
+        os.makedirs(path, exist_ok = True)
+        self.n_rows = 0
+        self.metadata = {} if metadata is None else dict(metadata)
+        meta_path = os.path.join(path, META_FILE)
+        if os.path.exists(meta_path):
+            with open(meta_path) as f:
+                meta = json.load(f)
+            if meta['nstates'] != nstates:
+                raise ValueError('Store {0} holds windows of {1} weeks, not {2}'.format(path, meta['nstates'], nstates))
+            if meta.get('state_width', 5) != state_width:
+                raise ValueError('Store {0} holds state rows of {1} entries, not {2}'.format(
+                                 path, meta.get('state_width', 5), state_width))
+            if [column[0] for column in meta['columns']] != [name for name, _, _ in self.layout]:
+                raise ValueError('Store {0} was written with other columns and cannot be appended to'.format(path))
+            self.n_rows = meta['n_rows']
+            self.metadata = dict(meta.get('metadata', {}), **self.metadata)
+        self._truncate()
+
+        self.buffers = {name : np.empty((chunk_size,) + shape, dtype = dtype) for name, dtype, shape in self.layout}
+        self.position = 0
+        return
+
+    def _truncate(self):
+        for name, dtype, shape in self.layout:
+            column_path = os.path.join(self.path, name + '.bin')
+            if not os.path.exists(column_path):
+                continue
+            size = self.n_rows * np.dtype(dtype).itemsize * int(np.prod(shape))
+            if os.path.getsize(column_path) < size:
+                raise ValueError('Column {0} of store {1} holds fewer than {2} rows'.format(name, self.path, self.n_rows))
+            with open(column_path, 'r+b') as f:
+                f.truncate(size)
+        return
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def record(self, episode, week, actor, state, action, order, reward, stock, backorders, cost, lost = 0):
+        """
+        -------------------------------------------------------
+        Appends one actor-week record.
+        -------------------------------------------------------
+        Preconditions: actor - an actor name from ACTORS or its index.
+            action - the policy action, None for rule-based policies.
+            cost - the costs incurred by the actor so far.
+            lost - the units of demand lost this week under lost sales.
+        Postconditions: The record is buffered; the buffer is written
+            out when it reaches chunk_size records.
+        -------------------------------------------------------
+        """
+        i = self.position
+        b = self.buffers
+        b['episode'][i] = episode
+        b['week'][i] = week
+        b['actor'][i] = ACTORS.index(actor) if isinstance(actor, str) else actor
+        if not isinstance(state, np.ndarray):
+            # Short rows (empty in-transit queue) are stored with 0 in the missing entry.
+            state = [list(row) + [0] * (self.state_width - len(row)) for row in state]
+        b['state'][i] = state
+        b['action'][i] = -1 if action is None else action
+        b['order'][i] = order
+        b['reward'][i] = reward
+        b['stock'][i] = stock
+        b['backorders'][i] = backorders
+        b['cost'][i] = cost
+        b['lost'][i] = lost
+
+        self.position += 1
+        if self.position == self.chunk_size:
+            self.flush()
+        return
+
+    def record_step(self, simulator, res, episode = 0):
+        """
+        -------------------------------------------------------
+        Appends the four records of a simulator step.
+        -------------------------------------------------------
+        Preconditions: simulator - a beer_game_Simulator which just
+                returned res from step(), with the writer's state_width.
+            episode - the episode number the step belongs to.
+        Postconditions: One record per actor is buffered.
+        -------------------------------------------------------
+        """
+        if simulator.cost_model is not None and simulator.cost_model.gridShape != ():
+            raise ValueError('A store records a single cost structure, not a grid of {0} : record the runs under one '
+                             'structure and price the grid with SupplyChainAnalytics.cost_decomposition'.format(
+                             simulator.cost_model.gridShape))
+        if simulator.stateWidth != self.state_width:
+            raise ValueError('The simulator plays state rows of {0} entries but the store holds {1} : create the writer '
+                             'with state_width = simulator.stateWidth'.format(simulator.stateWidth, self.state_width))
+        actors = (simulator.myRetailer, simulator.myWholesaler, simulator.myDistributor, simulator.myFactory)
+        week = simulator.weekt - 1
+        for index, (name, actor) in enumerate(zip(ACTORS, actors)):
+            r = res[name]
+            self.record(episode, week, index, r['state'], r['action'], actor.GetLastOrderQuantity(), r['reward'],
+                        actor.currentStock, actor.currentOrders, actor.GetCostIncurred(), actor.lostThisTurn)
+        return
+
+    def flush(self):
+        """
+        -------------------------------------------------------
+        Writes the buffered records to disk.
+        -------------------------------------------------------
+        Preconditions: None.
+        Postconditions: Every column file is extended with the buffered
+            rows and meta.json is then replaced atomically, so that a
+            reader opened afterwards sees them and an interrupted flush
+            leaves the previous meta.json in place.
+        -------------------------------------------------------
+        """
+        if self.position == 0:
+            return
+        for name, _, _ in self.layout:
+            with open(os.path.join(self.path, name + '.bin'), 'ab') as f:
+                self.buffers[name][:self.position].tofile(f)
+        self.n_rows += self.position
+        self.position = 0
+
+        meta = {'n_rows' : self.n_rows , 'nstates' : self.nstates , 'state_width' : self.state_width ,
+                'actors' : list(ACTORS) ,
+                'columns' : [[name, dtype, list(shape)] for name, dtype, shape in self.layout] ,
+                'metadata' : self.metadata}
+        meta_path = os.path.join(self.path, META_FILE)
+        with open(meta_path + '.tmp', 'w') as f:
+            json.dump(meta, f)
+        os.replace(meta_path + '.tmp', meta_path)
+        return
+
+    def close(self):
+        self.flush()
+        return
+
+
+##############################################################################################
+
+
+class TrajectoryReader:
+
+    def __init__(self, path):
+        """
+        -------------------------------------------------------
+        Constructor for the TrajectoryReader class.
+        -------------------------------------------------------
+        Preconditions: path - a store directory written by a
+                TrajectoryWriter.
+        Postconditions:
+            Memory-maps every column read-only. Nothing is loaded
+            until it is indexed.
+        -------------------------------------------------------
+        """
+        self.path = path
+        with open(os.path.join(path, META_FILE)) as f:
+            meta = json.load(f)
+
+        self.n_rows = meta['n_rows']
+        self.nstates = meta['nstates']
+        self.state_width = meta.get('state_width', 5)
+        self.actors = tuple(meta['actors'])
+        self.metadata = meta.get('metadata', {})
+        self.columns = {}
+        for name, dtype, shape in meta['columns']:
+            if self.n_rows == 0:
+                self.columns[name] = np.empty((0,) + tuple(shape), dtype = dtype)
+            else:
+                self.columns[name] = np.memmap(os.path.join(path, name + '.bin'), dtype = dtype, mode = 'r',
+                                               shape = (self.n_rows,) + tuple(shape))
+        return
+
+    def __len__(self):
+        return self.n_rows
+
+    def __getitem__(self, name):
+        return self.columns[name]
+
+    def actor_mask(self, actor):
+        """
+        -------------------------------------------------------
+        Returns a boolean mask selecting the records of one actor.
+        -------------------------------------------------------
+        Preconditions: actor - an actor name from ACTORS or its index.
+        Postconditions: Returns an array of n_rows booleans.
+        -------------------------------------------------------
+        """
+        index = self.actors.index(actor) if isinstance(actor, str) else actor
+        return self.columns['actor'] == index
+
+    def iter_chunks(self, chunk_size = 65536):
+        """
+        -------------------------------------------------------
+        Iterates over the store in consecutive row ranges.
+        -------------------------------------------------------
+        Preconditions: chunk_size - the number of rows per chunk.
+        Postconditions: Yields dicts mapping each column name to a
+            memory-mapped slice of at most chunk_size rows.
+        -------------------------------------------------------
+        """
+        for start in range(0, self.n_rows, chunk_size):
+            yield {name : column[start:start + chunk_size] for name, column in self.columns.items()}